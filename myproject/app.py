@@ -1,17 +1,39 @@
 #imports
+import atexit
+import base64
+import io
+import json
+import logging
 import os
-from flask import Flask, request, jsonify
+import random
+import re
+from contextlib import nullcontext
+from datetime import datetime, timezone
+from flask import Flask, Response, request, jsonify, g, has_request_context, stream_with_context
 from flask_cors import CORS
-from flask_jwt_extended import JWTManager, create_access_token, jwt_required, get_jwt_identity
+from flask_jwt_extended import JWTManager, create_access_token, create_refresh_token, jwt_required, get_jwt_identity
 from supabase import create_client, Client
-import joblib
 from dotenv import load_dotenv
-from gotrue.errors import AuthApiError
-import traceback
+from gotrue.errors import AuthApiError, AuthRetryableError
+
+# Local modules: imported as a package by the tests, flat inside the Docker image
+if __package__:
+    from .auth import AuthClientPool, LoginRateLimiter, gotrue_factory, login_keys
+    from .cache import ClassificationCache, FileBackend, HistoryCache, MemoryBackend
+    from .metrics import Metrics, RequestTimer
+    from .model_store import LazyModel
+    from .persistence import QueueFull, WriteBehindQueue
+    from .uploads import chunked, detect_format, iter_csv, iter_eml, iter_mbox
+else:
+    from auth import AuthClientPool, LoginRateLimiter, gotrue_factory, login_keys
+    from cache import ClassificationCache, FileBackend, HistoryCache, MemoryBackend
+    from metrics import Metrics, RequestTimer
+    from model_store import LazyModel
+    from persistence import QueueFull, WriteBehindQueue
+    from uploads import chunked, detect_format, iter_csv, iter_eml, iter_mbox
 
 # Load environment variables
 load_dotenv()
-print("DEBUG Supabase URL:", os.getenv("SUPABASE_URL"))
 
 
 # Flask app setup
@@ -21,10 +43,23 @@ app.config['JWT_SECRET_KEY'] = os.getenv("JWT_SECRET_KEY")
 CORS(app, resources={r"/*": {"origins": [
     "https://spamshield-52b58.web.app",
     "https://spamshield-52b58.firebaseapp.com"
-]}}, supports_credentials=True)
+]}}, supports_credentials=True, expose_headers=["X-Next-Cursor", "X-Model-Version"])
 
 jwt = JWTManager(app)
 
+# Request latency histograms served at /metrics. A sample of requests
+# (METRICS_LOG_SAMPLE_RATE, 0 to 1) is also logged with per-stage timings.
+metrics = Metrics()
+METRICS_LOG_SAMPLE_RATE = float(os.getenv("METRICS_LOG_SAMPLE_RATE", 0))
+
+# app.logger only emits warnings outside debug mode, under gunicorn too, so
+# the sampled lines get a logger of their own that always writes to stderr
+request_log = logging.getLogger('spamshield.requests')
+if not request_log.handlers:
+    request_log.setLevel(logging.INFO)
+    request_log.addHandler(logging.StreamHandler())
+    request_log.propagate = False
+
 # Supabase setup
 SUPABASE_URL = os.getenv("SUPABASE_URL")
 SUPABASE_KEY = os.getenv("SUPABASE_KEY")
@@ -34,9 +69,146 @@ if not SUPABASE_URL or not SUPABASE_KEY:
 
 supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
 
-# Load trained spam classifier and vectorizer
-spam_classifier = joblib.load("spam_classifier.pkl")
-vectorizer = joblib.load("vectorizer.pkl")
+# Pool of auth clients so concurrent logins don't share one session
+auth_pool = AuthClientPool(
+    gotrue_factory(SUPABASE_URL, SUPABASE_KEY,
+                   timeout=float(os.getenv("AUTH_TIMEOUT", 5)),
+                   keepalive_expiry=float(os.getenv("AUTH_KEEPALIVE", 60))),
+    size=int(os.getenv("AUTH_POOL_SIZE", 8)),
+)
+login_limiter = LoginRateLimiter(
+    max_failures=int(os.getenv("LOGIN_MAX_FAILURES", 5)),
+    window=float(os.getenv("LOGIN_FAILURE_WINDOW", 300)),
+)
+
+# Recent /history pages per user, dropped whenever the user's rows change.
+# The cache is per worker, and other workers only see a change once their
+# copy expires, so the TTL bounds how stale a page can be.
+history_cache = HistoryCache(ttl=float(os.getenv("HISTORY_CACHE_TTL", 5)))
+
+
+def invalidate_history(records):
+    for email in {record.get('email') for record in records}:
+        history_cache.invalidate(email)
+
+
+# Classified messages are written in the background, in micro-batches
+writer = WriteBehindQueue(
+    supabase,
+    on_flushed=invalidate_history,
+    batch_size=int(os.getenv("WRITE_BATCH_SIZE", 100)),
+    flush_interval=float(os.getenv("WRITE_FLUSH_INTERVAL", 0.5)),
+    max_queue=int(os.getenv("WRITE_QUEUE_SIZE", 10000)),
+    spill_path=os.getenv("WRITE_SPILL_PATH", "/tmp/spamshield-spill.jsonl"),
+    metrics=metrics,
+)
+atexit.register(lambda: writer.close())
+
+# Trained spam classifier and vectorizer, compiled into a lightweight scorer.
+# Loaded on first use from the memory-mapped store built by model_store.py,
+# falling back to the pickles when the store is missing or out of date.
+# Versions published to the registry by retrain.py replace it without a restart.
+MODEL_FILES = ["spam_classifier.pkl", "vectorizer.pkl"]
+model = LazyModel(
+    os.getenv("MODEL_STORE_DIR", "model_store"), *MODEL_FILES,
+    registry_dir=os.getenv("MODEL_REGISTRY_DIR", "models"),
+    check_interval=float(os.getenv("MODEL_CHECK_INTERVAL", 10)),
+)
+
+# Cache of results for repeated texts; CLASSIFY_CACHE_SIZE=0 disables it
+CACHE_SIZE = int(os.getenv("CLASSIFY_CACHE_SIZE", 10000))
+CACHE_TTL = float(os.getenv("CLASSIFY_CACHE_TTL", 0)) or None
+
+if CACHE_SIZE <= 0:
+    result_cache = None
+elif os.getenv("CLASSIFY_CACHE_BACKEND", "memory") == "file":
+    result_cache = ClassificationCache(
+        FileBackend(os.getenv("CLASSIFY_CACHE_PATH", "/tmp/spamshield-cache.sqlite3"),
+                    max_entries=CACHE_SIZE, ttl=CACHE_TTL),
+        watch=MODEL_FILES)
+else:
+    result_cache = ClassificationCache(
+        MemoryBackend(max_entries=CACHE_SIZE, ttl=CACHE_TTL), watch=MODEL_FILES)
+
+# Upper bound on the number of messages accepted by /classify/batch
+MAX_BATCH_SIZE = int(os.getenv("MAX_BATCH_SIZE", 1000))
+
+# /classify/upload scores messages in chunks of UPLOAD_CHUNK_SIZE; emails
+# longer than UPLOAD_MAX_MESSAGE_BYTES are truncated and CSV rows skipped
+UPLOAD_CHUNK_SIZE = int(os.getenv("UPLOAD_CHUNK_SIZE", 256))
+UPLOAD_MAX_MESSAGE_BYTES = int(os.getenv("UPLOAD_MAX_MESSAGE_BYTES", 1 << 20))
+UPLOAD_FLUSH_TIMEOUT = float(os.getenv("UPLOAD_FLUSH_TIMEOUT", 30))
+
+
+def stage(name):
+    """Time a stage of the current request; does nothing outside a request."""
+    timer = g.get('timer') if has_request_context() else None
+    return timer.stage(name) if timer else nullcontext()
+
+
+def classify_texts(texts):
+    """Classify a list of texts in one vectorized pass of the compiled scorer.
+
+    Cached results are reused and only the misses are scored. Returns the
+    model version and a list of (label, confidence) tuples in the same order
+    as texts.
+    """
+    version, scorer = model.get()
+    if result_cache is None:
+        return version, score_texts(scorer, texts)
+
+    with stage('cache'):
+        results = [result_cache.get(text, version) for text in texts]
+    missing = [i for i, result in enumerate(results) if result is None]
+    if missing:
+        scored = score_texts(scorer, [texts[i] for i in missing])
+        with stage('cache'):
+            for i, result in zip(missing, scored):
+                results[i] = result
+                result_cache.set(texts[i], version, result)
+    return version, [tuple(result) for result in results]
+
+
+def score_texts(scorer, texts):
+    with stage('vectorize'):
+        features = scorer.features(texts)
+    with stage('predict'):
+        return scorer.score(texts, features)
+
+
+@app.before_request
+def start_timer():
+    g.timer = RequestTimer()
+
+
+@app.after_request
+def record_request_metrics(response):
+    timer = g.get('timer')
+    if timer is None:
+        return response
+    endpoint = request.endpoint or 'unknown'
+    elapsed = timer.elapsed()
+    metrics.observe('http_request_duration_seconds', elapsed,
+                    endpoint=endpoint, method=request.method, status=response.status_code)
+    for name, seconds in timer.stages.items():
+        metrics.observe('http_request_stage_duration_seconds', seconds, endpoint=endpoint, stage=name)
+
+    if METRICS_LOG_SAMPLE_RATE and random.random() < METRICS_LOG_SAMPLE_RATE:
+        request_log.info(json.dumps({
+            'endpoint': endpoint,
+            'status': response.status_code,
+            'duration_ms': round(elapsed * 1000, 3),
+            'stages_ms': {name: round(seconds * 1000, 3) for name, seconds in timer.stages.items()},
+        }))
+    return response
+
+
+@app.after_request
+def add_model_version(response):
+    # Ties every response to the model serving this worker, once it is loaded
+    if model.version:
+        response.headers['X-Model-Version'] = model.version
+    return response
 
 # Routes
 
@@ -51,12 +223,23 @@ def signup():
     password = data.get('password')
 
     try:
-        response = supabase.auth.sign_up({'email': email, 'password': password})
+        response = auth_pool.sign_up({'email': email, 'password': password})
         return jsonify({'message': 'User registered successfully'}), 201
 
     except AuthApiError as e:
         return jsonify({'message': str(e)}), 400
 
+    except AuthRetryableError:
+        return jsonify({'message': 'Authentication service unavailable'}), 503
+
+
+def client_address():
+    # The proxy in front of the app appends the address it saw to
+    # X-Forwarded-For; entries before it are supplied by the client
+    if request.headers.get('X-Forwarded-For'):
+        return request.access_route[-1]
+    return request.remote_addr
+
 
 @app.route('/login', methods=['POST'])
 def login():
@@ -64,19 +247,45 @@ def login():
     email = data.get('email')
     password = data.get('password')
 
-    try:
-        response = supabase.auth.sign_in_with_password({'email': email, 'password': password})
+    # Repeated bad credentials, and repeated failures from one client, are
+    # rejected without asking Supabase again
+    limiter_keys = login_keys(email, password, client_address())
+    retry_after = max(login_limiter.retry_after(key) for key in limiter_keys)
+    if retry_after:
+        response = jsonify({'message': 'Too many failed login attempts'})
+        response.headers['Retry-After'] = str(int(retry_after) + 1)
+        return response, 429
 
+    try:
+        response = auth_pool.sign_in_with_password({'email': email, 'password': password})
 
         if not response.session:
+            for key in limiter_keys:
+                login_limiter.record_failure(key)
             return jsonify({'message': 'Login failed'}), 401
 
+        for key in limiter_keys:
+            login_limiter.reset(key)
         access_token = create_access_token(identity=email)
-        return jsonify({'access_token': access_token}), 200
+        refresh_token = create_refresh_token(identity=email)
+        return jsonify({'access_token': access_token, 'refresh_token': refresh_token}), 200
 
     except AuthApiError as e:
+        for key in limiter_keys:
+            login_limiter.record_failure(key)
         return jsonify({'message': str(e)}), 401
 
+    except AuthRetryableError:
+        return jsonify({'message': 'Authentication service unavailable'}), 503
+
+
+@app.route('/refresh', methods=['POST'])
+@jwt_required(refresh=True)
+def refresh():
+    # Issues a new access token locally, without another Supabase sign-in
+    access_token = create_access_token(identity=get_jwt_identity())
+    return jsonify({'access_token': access_token}), 200
+
 
 @app.route('/protected', methods=['GET'])
 @jwt_required()
@@ -89,53 +298,320 @@ def protected():
 def classify():
     try:
         current_user = get_jwt_identity()
-        print(f"DEBUG: Current User: {current_user}")
 
-        data = request.json
-        print(f"DEBUG: Request Data: {data}")
-        text = data.get('text')
-        print(f"DEBUG: Input Text: {text}")
+        with stage('parse'):
+            data = request.json
+            text = data.get('text')
 
         if not text:
             return jsonify({'error': 'No text provided'}), 400
 
-        if not vectorizer or not spam_classifier:
-            print("ERROR: Vectorizer or model not loaded.")
-            return jsonify({'error': 'Model not loaded.'}), 500
+        version, [(label, confidence)] = classify_texts([text])
+
+        with stage('db_insert'):
+            message_id = writer.submit({
+                'message': text,
+                'label': label,
+                'confidence': float(confidence),
+                'email': current_user,
+                'model_version': version
+            })
+            history_cache.invalidate(current_user)
+
+        with stage('serialize'):
+            return jsonify({
+                'id': message_id,
+                'text': text,
+                'label': label,
+                'confidence': float(confidence),
+                'model_version': version
+            })
+
+    except QueueFull:
+        return jsonify({'error': 'Server busy, please retry.'}), 503
+
+    except Exception as e:
+        app.logger.exception("Classification failed")
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/classify/batch', methods=['POST'])
+@jwt_required()
+def classify_batch():
+    try:
+        current_user = get_jwt_identity()
+        with stage('parse'):
+            data = request.json or {}
+            messages = data.get('messages')
+
+        if not isinstance(messages, list) or not messages:
+            return jsonify({'error': 'No messages provided'}), 400
+
+        if len(messages) > MAX_BATCH_SIZE:
+            return jsonify({'error': f'Batch too large (max {MAX_BATCH_SIZE} messages)'}), 413
+
+        if not all(isinstance(text, str) and text for text in messages):
+            return jsonify({'error': 'Every message must be a non-empty string'}), 400
+
+        version, results = classify_texts(messages)
+
+        # The whole batch is queued at once and written with bulk inserts
+        with stage('db_insert'):
+            ids = writer.submit_many([
+                {
+                    'message': text,
+                    'label': label,
+                    'confidence': confidence,
+                    'email': current_user,
+                    'model_version': version
+                }
+                for text, (label, confidence) in zip(messages, results)
+            ])
+            history_cache.invalidate(current_user)
+
+        with stage('serialize'):
+            return jsonify({'model_version': version, 'results': [
+                {
+                    'id': message_id,
+                    'label': label,
+                    'confidence': confidence
+                }
+                for message_id, (label, confidence) in zip(ids, results)
+            ]}), 200
+
+    except QueueFull:
+        return jsonify({'error': 'Server busy, please retry.'}), 503
 
-        print("DEBUG: Classifier type:", type(spam_classifier))
-        print("DEBUG: Vectorizer type:", type(vectorizer))
+    except Exception as e:
+        app.logger.exception("Classification failed")
+        return jsonify({'error': str(e)}), 500
 
-        text_vectorized = vectorizer.transform([text])
-        prediction = spam_classifier.predict(text_vectorized)[0]
-        confidence = spam_classifier.predict_proba(text_vectorized)[0].max()
-        label = "Spam" if prediction == 1 else "Ham"
 
-        response = supabase.table('classified_messages').insert({
-            'message': text,
-            'label': label,
-            'confidence': float(confidence),
-            'email': current_user
-        }).execute()
+def parse_upload(stream, fmt, column=None):
+    """Return an iterator of (ref, text) for the messages of an upload."""
+    if fmt == 'mbox':
+        return iter_mbox(stream, UPLOAD_MAX_MESSAGE_BYTES)
+    if fmt == 'eml':
+        return iter_eml(stream, UPLOAD_MAX_MESSAGE_BYTES)
+    if fmt == 'csv':
+        return iter_csv(stream, column, UPLOAD_MAX_MESSAGE_BYTES)
+    raise ValueError('format must be one of mbox, eml, csv')
 
-        print(f"DEBUG: Supabase Response: {response}")
 
-        if not hasattr(response, "data") or not response.data:
-            print("ERROR: Supabase insert failed or no data returned.")
-            return jsonify({'error': 'Failed to save message to database.'}), 500
+@app.route('/classify/upload', methods=['POST'])
+@jwt_required()
+def classify_upload():
+    """Classify every message of an mbox, EML or CSV upload as it streams in.
+
+    The file is either the raw request body or the "file" field of a
+    multipart form. Results are streamed back as NDJSON, one line per
+    message ({"index", "ref", "label", "confidence"} and "id" when
+    persisted, without the text; or {"index", "ref", "skipped"} for a CSV row
+    too large to read), followed by a {"summary": ...} line. An
+    error after the response has started is reported as an {"error": ...}
+    line instead of a summary.
+    """
+    current_user = get_jwt_identity()
+    persist = request.args.get('persist', '').lower() in ('1', 'true', 'yes')
 
-        return jsonify({
-            'id': response.data[0]['id'],
-            'text': text,
-            'label': label,
-            'confidence': float(confidence)
-        })
+    upload = request.files.get('file') if request.mimetype == 'multipart/form-data' else None
+    if upload is not None:
+        stream, filename, content_type = upload.stream, upload.filename, upload.mimetype
+        # Flask closes uploaded files when the view returns, before the
+        # response is streamed, so take the spooled file over and close it here
+        upload.stream = io.BytesIO()
+    else:
+        stream, filename, content_type = request.stream, None, request.mimetype
 
-    except Exception as e:
-        import traceback
-        print("ERROR:", str(e))
-        traceback.print_exc()
-        return jsonify({'error': str(e)}), 500
+    try:
+        fmt = request.args.get('format') or detect_format(filename, content_type)
+        messages = parse_upload(stream, fmt, request.args.get('column'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    # One model for the whole upload, even if a new one is published meanwhile.
+    # The result cache is bypassed so a bulk scan does not evict hot entries.
+    version, scorer = model.get()
+
+    def generate():
+        index = count = spam = skipped = 0
+        try:
+            for chunk in chunked(messages, UPLOAD_CHUNK_SIZE):
+                texts = [text for _, text in chunk if text is not None]
+                results = score_texts(scorer, texts) if texts else []
+
+                ids = [None] * len(texts)
+                if persist and texts:
+                    # Let the queue drain rather than spill a large upload to disk
+                    if writer.pending() + len(chunk) > writer.max_queue // 2:
+                        writer.flush(timeout=UPLOAD_FLUSH_TIMEOUT)
+                    ids = writer.submit_many([
+                        {
+                            'message': text,
+                            'label': label,
+                            'confidence': confidence,
+                            'email': current_user,
+                            'model_version': version
+                        }
+                        for text, (label, confidence) in zip(texts, results)
+                    ])
+
+                lines = []
+                scored = iter(zip(ids, results))
+                for ref, text in chunk:
+                    if text is None:
+                        # Rows too large to read whole are reported, not guessed at
+                        line = {'index': index, 'ref': ref, 'skipped': 'message too large'}
+                        skipped += 1
+                    else:
+                        message_id, (label, confidence) = next(scored)
+                        line = {'index': index, 'ref': ref, 'label': label, 'confidence': confidence}
+                        if message_id:
+                            line['id'] = message_id
+                        count += 1
+                        spam += label == 'Spam'
+                    lines.append(json.dumps(line) + '\n')
+                    index += 1
+                yield ''.join(lines)
+
+        except QueueFull:
+            yield json.dumps({'error': 'Server busy, please retry.', 'processed': count}) + '\n'
+            return
+        except Exception:
+            app.logger.exception("Upload classification failed")
+            yield json.dumps({'error': 'Failed to read upload.', 'processed': count}) + '\n'
+            return
+        finally:
+            if upload is not None:
+                stream.close()
+            if persist and count:
+                history_cache.invalidate(current_user)
+
+        yield json.dumps({'summary': {
+            'messages': count,
+            'spam': spam,
+            'skipped': skipped,
+            'model_version': version,
+            'persisted': persist
+        }}) + '\n'
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+
+@app.route('/cache/stats', methods=['GET'])
+def cache_stats():
+    if result_cache is None:
+        return jsonify({'enabled': False}), 200
+    return jsonify({'enabled': True, 'model_version': model.version, **result_cache.stats()}), 200
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    # Histograms plus the cache and write queue counters, in Prometheus format
+    lines = [metrics.render()]
+    counters = dict(writer.stats())
+    if result_cache is not None:
+        counters.update({f'cache_{name}': value for name, value in result_cache.stats().items()})
+    for name, value in sorted(counters.items()):
+        lines.append(f'# TYPE spamshield_{name} gauge\nspamshield_{name} {value}\n')
+    return ''.join(lines), 200, {'Content-Type': 'text/plain; version=0.0.4'}
+
+
+HISTORY_COLUMNS = ['id', 'created_at', 'message', 'label', 'confidence', 'is_classification_correct',
+                   'model_version']
+HISTORY_DEFAULT_LIMIT = 50
+HISTORY_MAX_LIMIT = 200
+FEEDBACK_FILTERS = {'correct': True, 'incorrect': False}
+
+
+def encode_cursor(row):
+    payload = json.dumps([row['created_at'], row['id']]).encode('utf-8')
+    return base64.urlsafe_b64encode(payload).decode('ascii')
+
+
+def decode_cursor(cursor):
+    created_at, message_id = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+    # Both values end up inside a PostgREST filter expression
+    if not re.fullmatch(r'[0-9T:.+\- Z]+', str(created_at)) or not re.fullmatch(r'[\w-]+', str(message_id)):
+        raise ValueError('Malformed cursor')
+    return str(created_at), str(message_id)
+
+
+def parse_history_args(args):
+    """Validate the /history query string; raises ValueError on bad input."""
+    limit = int(args.get('limit', HISTORY_DEFAULT_LIMIT))
+    if not 1 <= limit <= HISTORY_MAX_LIMIT:
+        raise ValueError(f'limit must be between 1 and {HISTORY_MAX_LIMIT}')
+
+    columns = HISTORY_COLUMNS
+    if 'fields' in args:
+        columns = [c.strip() for c in args['fields'].split(',') if c.strip()]
+        unknown = set(columns) - set(HISTORY_COLUMNS)
+        if unknown:
+            raise ValueError(f"Unknown fields: {', '.join(sorted(unknown))}")
+        # The cursor needs both keys, whatever the client asked for
+        columns = ['id', 'created_at'] + [c for c in columns if c not in ('id', 'created_at')]
+
+    feedback = args.get('feedback')
+    if feedback is not None and feedback not in ('correct', 'incorrect', 'none'):
+        raise ValueError('feedback must be one of correct, incorrect, none')
+
+    label = args.get('label')
+    if label is not None and label not in ('Spam', 'Ham'):
+        raise ValueError('label must be Spam or Ham')
+
+    # PostgREST rejects malformed timestamps; catch them here as a 400
+    since, until = (datetime.fromisoformat(args[name]).isoformat() if args.get(name) else None
+                    for name in ('since', 'until'))
+
+    cursor = decode_cursor(args['cursor']) if args.get('cursor') else None
+    return {
+        'limit': limit,
+        'columns': columns,
+        'cursor': cursor,
+        'label': label,
+        'since': since,
+        'until': until,
+        'feedback': feedback,
+    }
+
+
+def fetch_history(user, query):
+    """Fetch one page of history, newest first, keyed on (created_at, id).
+
+    Returns the rows and the cursor of the next page (None on the last page).
+    """
+    db_query = supabase.table('classified_messages') \
+        .select(','.join(query['columns'])) \
+        .eq('email', user)
+
+    if query['label']:
+        db_query = db_query.eq('label', query['label'])
+    if query['since']:
+        db_query = db_query.gte('created_at', query['since'])
+    if query['until']:
+        db_query = db_query.lt('created_at', query['until'])
+    if query['feedback'] == 'none':
+        db_query = db_query.is_('is_classification_correct', 'null')
+    elif query['feedback']:
+        db_query = db_query.eq('is_classification_correct', FEEDBACK_FILTERS[query['feedback']])
+    if query['cursor']:
+        created_at, message_id = query['cursor']
+        db_query = db_query.or_(
+            f'created_at.lt."{created_at}",'
+            f'and(created_at.eq."{created_at}",id.lt."{message_id}")'
+        )
+
+    # One extra row tells us whether there is a next page
+    response = db_query \
+        .order('created_at', desc=True) \
+        .order('id', desc=True) \
+        .limit(query['limit'] + 1) \
+        .execute()
+
+    rows = response.data[:query['limit']]
+    next_cursor = encode_cursor(rows[-1]) if len(response.data) > query['limit'] else None
+    return rows, next_cursor
 
 
 @app.route('/history', methods=['GET'])
@@ -143,30 +619,37 @@ def classify():
 def history():
     try:
         current_user = get_jwt_identity()
-        print(f"DEBUG: Fetching history for user: {current_user}")
-
-        # Query Supabase for the user's classification history
-        response = supabase.table('classified_messages') \
-            .select('*') \
-            .eq('email', current_user) \
-            .order('created_at', desc=True) \
-            .execute()
 
-        # Debug: Check Supabase response
-        print(f"DEBUG: History user: {current_user}")
-        print(f"DEBUG: Supabase History Response: {response}")
-
-        
+        try:
+            with stage('parse'):
+                query = parse_history_args(request.args)
+        except (ValueError, TypeError):
+            return jsonify({'error': 'Invalid history query.'}), 400
+
+        # Only first pages are cached; they are what clients poll
+        page_key = None if query['cursor'] else request.query_string.decode('utf-8')
+        cached = history_cache.get(current_user, page_key) if page_key is not None else None
+        if cached is not None:
+            rows, next_cursor = cached
+        else:
+            with stage('db_query'):
+                rows, next_cursor = fetch_history(current_user, query)
+            if page_key is not None:
+                history_cache.set(current_user, page_key, (rows, next_cursor))
 
         # Check if data is returned
-        if not response.data:
+        if not rows and not query['cursor']:
             return jsonify({'message': 'No history found for this user.'}), 404
 
-        # Return the history data
-        return jsonify(response.data), 200
+        # The page itself stays a plain list; the cursor goes in a header
+        with stage('serialize'):
+            response = jsonify(rows)
+        if next_cursor:
+            response.headers['X-Next-Cursor'] = next_cursor
+        return response, 200
 
-    except Exception as e:
-        print("ERROR:", str(e))
+    except Exception:
+        app.logger.exception("Failed to fetch history")
         return jsonify({'error': 'Failed to fetch history.'}), 500
 
 @app.route('/feedback', methods=['POST'])
@@ -179,18 +662,24 @@ def feedback():
     if message_id is None or is_correct is None:
         return jsonify({'error': 'Missing required fields'}), 400
 
-    try:
-        response = supabase.table('classified_messages').update({
-            'is_classification_correct': is_correct
-        }).eq('id', message_id).execute()
+    # retrain.py picks up feedback by when it was given, not when the message was
+    fields = {
+        'is_classification_correct': is_correct,
+        'feedback_at': datetime.now(timezone.utc).isoformat()
+    }
 
-        if response.data:
+    try:
+        # The message may still be in the write-behind queue or a spill file,
+        # in which case the writer applies the feedback once it is written
+        if writer.update(message_id, fields):
+            # Only now, or a concurrent /history could cache the old row again
+            history_cache.invalidate(get_jwt_identity())
             return jsonify({'success': True}), 200
         else:
             return jsonify({'error': 'Failed to update'}), 500
 
-    except Exception as e:
-        print(f"Feedback error: {e}")
+    except Exception:
+        app.logger.exception("Feedback update failed")
         return jsonify({'error': 'Server error'}), 500
 
 if __name__ == '__main__':
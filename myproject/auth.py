@@ -0,0 +1,162 @@
+"""Pooled access to Supabase Auth.
+
+A gotrue client keeps the signed-in session as instance state, so the single
+client created by create_client cannot safely serve concurrent logins. The
+pool hands each request its own client, each with a keep-alive HTTP
+connection and explicit timeouts. LoginRateLimiter rejects repeated bad
+credentials locally instead of sending them to Supabase again.
+"""
+import hashlib
+import hmac
+import queue
+import secrets
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+
+import httpx
+from gotrue import SyncGoTrueClient
+from gotrue.errors import AuthRetryableError
+from gotrue.http_clients import SyncClient
+
+
+class PoolExhausted(AuthRetryableError):
+    """Raised when no auth client frees up within the pool's acquire_timeout.
+
+    It is an AuthRetryableError, so callers answer it like an unreachable
+    auth service.
+    """
+
+    def __init__(self, timeout):
+        super().__init__(f"No auth client available within {timeout}s", 503)
+
+
+def gotrue_factory(supabase_url, supabase_key, timeout=5.0, keepalive_expiry=60.0):
+    """Return a callable creating gotrue clients for the project's auth API."""
+    def create():
+        http_client = SyncClient(
+            timeout=httpx.Timeout(timeout),
+            limits=httpx.Limits(max_connections=1, max_keepalive_connections=1,
+                                keepalive_expiry=keepalive_expiry),
+        )
+        return SyncGoTrueClient(
+            url=f"{supabase_url}/auth/v1",
+            headers={'apiKey': supabase_key, 'Authorization': f'Bearer {supabase_key}'},
+            http_client=http_client,
+            auto_refresh_token=False,
+            persist_session=False,
+        )
+    return create
+
+
+class AuthClientPool:
+    """Fixed-size, thread-safe pool of auth clients created on demand."""
+
+    def __init__(self, factory, size=8, acquire_timeout=10.0):
+        self.factory = factory
+        self.size = size
+        self.acquire_timeout = acquire_timeout
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def client(self):
+        """Check out a client for the duration of the with block."""
+        client = self._acquire()
+        try:
+            yield client
+        finally:
+            self._idle.put(client)
+
+    def _acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if self._created < self.size:
+                self._created += 1
+                create = True
+            else:
+                create = False
+        if create:
+            try:
+                return self.factory()
+            except Exception:
+                with self._lock:
+                    self._created -= 1
+                raise
+        try:
+            return self._idle.get(timeout=self.acquire_timeout)
+        except queue.Empty:
+            raise PoolExhausted(self.acquire_timeout) from None
+
+    def sign_in_with_password(self, credentials):
+        with self.client() as auth:
+            return auth.sign_in_with_password(credentials)
+
+    def sign_up(self, credentials):
+        with self.client() as auth:
+            return auth.sign_up(credentials)
+
+
+# Keys the credential hashes held by the limiter; they never leave the process
+_CREDENTIALS_KEY = secrets.token_bytes(32)
+
+
+def login_keys(email, password, address):
+    """Return the limiter keys of a login attempt.
+
+    One is the exact (email, password) pair, so the same bad credentials are
+    rejected locally whoever sends them; the other is the (email, client
+    address) pair, which limits guessing from one client. Neither is the
+    email alone, so nobody can lock the owner out of their account.
+    """
+    email = (email or '').lower()
+    digest = hmac.new(_CREDENTIALS_KEY, f"{email}\0{password or ''}".encode('utf-8'),
+                      hashlib.sha256).hexdigest()
+    return [f'credentials:{digest}', f'client:{email}:{address}']
+
+
+class LoginRateLimiter:
+    """Blocks a key after max_failures failed logins within window seconds.
+
+    At most max_keys keys are tracked; the least recently failing ones are
+    forgotten first.
+    """
+
+    def __init__(self, max_failures=5, window=300, max_keys=10000):
+        self.max_failures = max_failures
+        self.window = window
+        self.max_keys = max_keys
+        self._failures = OrderedDict()
+        self._lock = threading.Lock()
+
+    def retry_after(self, key):
+        """Return the seconds until key may try again, or 0 if it is allowed."""
+        now = time.monotonic()
+        with self._lock:
+            failures = self._failures.get(key)
+            if not failures:
+                return 0
+            while failures and failures[0] <= now - self.window:
+                failures.popleft()
+            if not failures:
+                del self._failures[key]
+                return 0
+            if len(failures) < self.max_failures:
+                return 0
+            return failures[0] + self.window - now
+
+    def record_failure(self, key):
+        with self._lock:
+            self._failures.setdefault(key, deque(maxlen=self.max_failures)).append(time.monotonic())
+            self._failures.move_to_end(key)
+            while len(self._failures) > self.max_keys:
+                self._failures.popitem(last=False)
+
+    def reset(self, key):
+        with self._lock:
+            self._failures.pop(key, None)
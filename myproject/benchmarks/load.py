@@ -0,0 +1,212 @@
+"""Concurrent load benchmark for the classify and history endpoints.
+
+Runs the app in process with the Flask test client, one client per thread,
+against the in-memory database with an optional simulated round-trip latency.
+Messages are made unique so every request misses the result cache, and the
+history cache is off unless HISTORY_CACHE_TTL is set. The table is reset to
+the same HISTORY_ROWS rows before each scenario, so history queries do not
+slow down with the rows the classify scenarios wrote to the fake. It reports the latency
+percentiles and throughput of each scenario, followed by the per-stage
+histograms the app exports at /metrics.
+
+    python -m myproject.benchmarks.load --concurrency 8 --requests 2000
+
+With --max-p95-ms the exit status is 1 if any scenario's p95 is above the
+budget, so the benchmark can gate CI. The budget is one number for every
+scenario or one per scenario, e.g. classify=5,batch=25,history=5. For a
+gate, run with --concurrency 1 and no simulated latency: requests then
+measure the app's own cost instead of threads queueing for the GIL, which
+keeps p95 steady enough for a tight budget.
+"""
+import argparse
+import itertools
+import json
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+MODEL_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+MESSAGES = [
+    'WINNER!! You have won a free prize, call now to claim',
+    'Are we still meeting for lunch tomorrow?',
+    'URGENT: your account has been selected for a cash reward',
+    'Can you send me the notes from class?',
+]
+
+HISTORY_ROWS = 500
+
+
+def seed_rows():
+    return [
+        {'id': f'{i:06d}', 'created_at': f'2025-03-01T00:00:{i % 60:02d}.{i:06d}+00:00',
+         'message': MESSAGES[i % len(MESSAGES)], 'label': 'Spam' if i % 2 else 'Ham',
+         'confidence': 0.9, 'email': 'load@example.com', 'model_version': 'benchmark',
+         'is_classification_correct': None}
+        for i in range(HISTORY_ROWS)
+    ]
+
+
+def configure_environment(spill_dir):
+    # The app reads its configuration at import time, with model paths
+    # relative to the directory it is started from
+    os.chdir(MODEL_DIR)
+    os.environ.setdefault('SUPABASE_URL', 'https://benchmark.supabase.co')
+    os.environ.setdefault('SUPABASE_KEY', 'benchmark.benchmark.benchmark')
+    os.environ.setdefault('JWT_SECRET_KEY', 'benchmark-secret-key-of-sufficient-length')
+    os.environ.setdefault('HISTORY_CACHE_TTL', '0')
+    os.environ.setdefault('WRITE_SPILL_PATH', os.path.join(spill_dir, 'spill.jsonl'))
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return float('nan')
+    index = min(len(sorted_values) - 1, max(0, round(q * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def run_scenario(app, make_request, concurrency, requests):
+    """Send requests from concurrency threads; return latencies and wall time."""
+    counter = itertools.count()
+    latencies, errors = [], []
+    lock = threading.Lock()
+
+    def worker():
+        client = app.test_client()
+        while next(counter) < requests:
+            start = time.perf_counter()
+            response = make_request(client)
+            elapsed = time.perf_counter() - start
+            with lock:
+                latencies.append(elapsed)
+                if response.status_code >= 400:
+                    errors.append(response.status_code)
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return sorted(latencies), errors, time.perf_counter() - start
+
+
+def parse_budget(text):
+    """Parse --max-p95-ms: a number, or scenario=ms pairs separated by commas."""
+    if '=' not in text:
+        return float(text)
+    return {name.strip(): float(ms) for name, ms in (pair.split('=', 1) for pair in text.split(','))}
+
+
+def summarize(name, latencies, errors, wall):
+    result = {
+        'scenario': name,
+        'requests': len(latencies),
+        'errors': len(errors),
+        'qps': len(latencies) / wall if wall else 0.0,
+        'mean_ms': statistics.fmean(latencies) * 1000 if latencies else float('nan'),
+    }
+    for q in (0.5, 0.95, 0.99):
+        result[f'p{round(q * 100)}_ms'] = percentile(latencies, q) * 1000
+    print(f"{name:9} {result['requests']:6d} req  {result['qps']:8.1f} req/s   "
+          f"p50 {result['p50_ms']:7.2f} ms  p95 {result['p95_ms']:7.2f} ms  "
+          f"p99 {result['p99_ms']:7.2f} ms  errors {result['errors']}")
+    return result
+
+
+def stage_breakdown(metrics):
+    """Print the mean time of each stage, per endpoint, from the app's histograms."""
+    for labels, histogram in metrics.collect('http_request_stage_duration_seconds'):
+        _, total, count = histogram.snapshot()
+        print(f"  {labels['endpoint']:15} {labels['stage']:10} {count:6d} x  "
+              f"mean {total / count * 1000:7.3f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--scenarios', default='classify,batch,history',
+                        help='comma-separated subset of classify, batch, history')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--requests', type=int, default=1000, help='requests per scenario')
+    parser.add_argument('--batch-size', type=int, default=50)
+    parser.add_argument('--db-latency-ms', type=float, default=0.0,
+                        help='simulated round-trip time of every database query')
+    parser.add_argument('--max-p95-ms', type=parse_budget,
+                        help='fail if a p95 exceeds this, e.g. 20 or classify=5,batch=25')
+    parser.add_argument('--json', help='also write the results to this file')
+    args = parser.parse_args()
+
+    spill_dir = tempfile.mkdtemp(prefix='spamshield-load-')
+    configure_environment(spill_dir)
+
+    from flask_jwt_extended import create_access_token
+
+    import myproject.app as app_module
+    from myproject.persistence import WriteBehindQueue
+    from myproject.testing import InMemorySupabase
+
+    db = InMemorySupabase()
+    db.latency = args.db_latency_ms / 1000
+    app_module.supabase = db
+    app_module.writer.close()
+    app_module.writer = WriteBehindQueue(db, spill_path=os.path.join(spill_dir, 'spill.jsonl'),
+                                         metrics=app_module.metrics)
+    app = app_module.app
+
+    with app.app_context():
+        token = create_access_token(identity='load@example.com')
+    headers = {'Authorization': f'Bearer {token}'}
+    unique = itertools.count()
+
+    def text():
+        n = next(unique)
+        return f'{MESSAGES[n % len(MESSAGES)]} #{n}'
+
+    scenarios = {
+        'classify': lambda client: client.post('/classify', json={'text': text()}, headers=headers),
+        'batch': lambda client: client.post(
+            '/classify/batch', json={'messages': [text() for _ in range(args.batch_size)]}, headers=headers),
+        'history': lambda client: client.get('/history?limit=20', headers=headers),
+    }
+
+    # Load the model before the clock starts
+    app_module.model.get()
+    print(f"concurrency {args.concurrency}, {args.requests} requests per scenario, "
+          f"db latency {args.db_latency_ms} ms, model {app_module.model.version}")
+
+    results = []
+    for name in args.scenarios.split(','):
+        name = name.strip()
+        if name not in scenarios:
+            parser.error(f'unknown scenario {name!r}')
+        app_module.writer.flush()
+        db.tables['classified_messages'] = seed_rows()
+        results.append(summarize(name, *run_scenario(app, scenarios[name], args.concurrency, args.requests)))
+
+    app_module.writer.close()
+    print('stages:')
+    stage_breakdown(app_module.metrics)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    failed = [r for r in results if r['errors']]
+    if args.max_p95_ms is not None:
+        budgets = args.max_p95_ms if isinstance(args.max_p95_ms, dict) else {}
+        default = None if budgets else args.max_p95_ms
+        for result in results:
+            budget = budgets.get(result['scenario'], default)
+            if budget is not None and result['p95_ms'] > budget and result not in failed:
+                failed.append(result)
+    for result in failed:
+        print(f"FAIL {result['scenario']}: p95 {result['p95_ms']:.2f} ms, {result['errors']} errors",
+              file=sys.stderr)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
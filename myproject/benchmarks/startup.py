@@ -0,0 +1,91 @@
+"""Startup and memory benchmark for model loading.
+
+Starts several worker processes at once, each loading the model and scoring
+one message, either from the pickles (scikit-learn) or from the mmap store.
+It reports, per strategy, the median load time, the median peak RSS and the
+median PSS (proportional set size: shared pages are split between the
+processes mapping them, so it shows what sharing saves).
+
+    python -m myproject.benchmarks.startup --workers 4
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+MODEL_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+WORKER = r'''
+import json, sys, time
+start = time.perf_counter()
+from myproject.model_store import LazyModel
+model = LazyModel(sys.argv[1], sys.argv[2], sys.argv[3])
+model.get()[1].score(["Congratulations, you have won a free cruise"])
+elapsed = time.perf_counter() - start
+
+def proc_kb(path, field):
+    # ru_maxrss survives exec on Linux, so read the peak from /proc instead
+    try:
+        with open(path) as f:
+            return next(int(line.split()[1]) for line in f if line.startswith(field))
+    except (OSError, StopIteration):
+        return None
+
+print(json.dumps({"load_seconds": elapsed,
+                  "max_rss_kb": proc_kb("/proc/self/status", "VmHWM:")}), flush=True)
+sys.stdin.readline()
+print(json.dumps({"pss_kb": proc_kb("/proc/self/smaps_rollup", "Pss:")}), flush=True)
+'''
+
+
+def run(store_dir, workers):
+    """Start workers together and collect their measurements."""
+    classifier = os.path.join(MODEL_DIR, 'spam_classifier.pkl')
+    vectorizer = os.path.join(MODEL_DIR, 'vectorizer.pkl')
+    env = dict(os.environ, PYTHONWARNINGS='ignore')
+    procs = [subprocess.Popen([sys.executable, '-c', WORKER, store_dir, classifier, vectorizer],
+                              stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True, env=env)
+             for _ in range(workers)]
+    # Every worker has loaded before any of them measures its PSS
+    results = [json.loads(proc.stdout.readline()) for proc in procs]
+    for proc, result in zip(procs, results):
+        proc.stdin.write('\n')
+        proc.stdin.flush()
+        result.update(json.loads(proc.stdout.readline()))
+        proc.wait()
+    return results
+
+
+def summarize(name, results):
+    def median(key):
+        values = [r[key] for r in results if r[key] is not None]
+        return statistics.median(values) if values else float('nan')
+
+    print(f"{name:8} load {median('load_seconds') * 1000:8.1f} ms   "
+          f"peak RSS {median('max_rss_kb') / 1024:7.1f} MiB   "
+          f"PSS {median('pss_kb') / 1024:7.1f} MiB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--workers', type=int, default=4)
+    args = parser.parse_args()
+
+    from myproject.model_store import compile_pickles, export_store
+
+    with tempfile.TemporaryDirectory() as tmp:
+        store_dir = os.path.join(tmp, 'store')
+        version, scorer = compile_pickles(os.path.join(MODEL_DIR, 'spam_classifier.pkl'),
+                                          os.path.join(MODEL_DIR, 'vectorizer.pkl'))
+        export_store(scorer, store_dir, version)
+
+        print(f"{args.workers} workers, model {version}")
+        summarize('pickle', run(os.path.join(tmp, 'missing'), args.workers))
+        summarize('store', run(store_dir, args.workers))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,297 @@
+"""Caches used by the API.
+
+Spam campaigns send the same text over and over, so classification results are
+cached by a hash of the normalised text and the version of the model that
+produced them. Two backends are available: an in-process LRU and a SQLite file
+that is shared by every gunicorn worker on the host.
+
+HistoryCache keeps each user's most recent /history pages for a few seconds,
+in each worker.
+"""
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+def normalize_text(text):
+    """Lowercase and collapse whitespace.
+
+    The vectorizer lowercases and only keeps word characters, so texts that
+    differ only in case or spacing always get the same classification.
+    """
+    return ' '.join(text.lower().split())
+
+
+def model_version(paths):
+    """Return a short content hash identifying the model files in paths."""
+    digest = hashlib.sha256()
+    for path in paths:
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                digest.update(block)
+    return digest.hexdigest()[:16]
+
+
+def cache_key(text, version):
+    payload = f"{version}\0{normalize_text(text)}".encode('utf-8')
+    return hashlib.sha256(payload).hexdigest()
+
+
+class MemoryBackend:
+    """Thread-safe in-process LRU with an optional TTL in seconds."""
+
+    def __init__(self, max_entries=10000, ttl=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires = entry
+            if expires is not None and expires < time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        """Store value and return the number of entries evicted."""
+        expires = time.time() + self.ttl if self.ttl else None
+        with self._lock:
+            self._entries[key] = (value, expires)
+            self._entries.move_to_end(key)
+            evicted = 0
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                evicted += 1
+            return evicted
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class FileBackend:
+    """LRU stored in a SQLite file, shared between worker processes.
+
+    Each thread gets its own connection; WAL mode lets readers in other
+    workers proceed while one of them writes. The row count is kept up to
+    date by triggers, so a set never scans the table, and hits only record
+    when a key was used every touch_batch hits or touch_interval seconds,
+    so a hit is a plain read. A hit still costs a query, so the file backend
+    only pays off when it saves scoring that is slower than that, or work
+    shared between workers; the memory backend is the faster default.
+    """
+
+    def __init__(self, path, max_entries=10000, ttl=None, touch_batch=100, touch_interval=1.0):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.touch_batch = touch_batch
+        self.touch_interval = touch_interval
+        self._local = threading.local()
+        self._touched = {}
+        self._touch_lock = threading.Lock()
+        self._next_touch = time.monotonic() + touch_interval
+        with self._connect() as db:
+            db.execute(
+                'CREATE TABLE IF NOT EXISTS results ('
+                'key TEXT PRIMARY KEY, label TEXT, confidence REAL, '
+                'expires REAL, used REAL)'
+            )
+            db.execute('CREATE INDEX IF NOT EXISTS results_used ON results (used)')
+            db.execute('BEGIN IMMEDIATE')
+            db.execute('CREATE TABLE IF NOT EXISTS size (id INTEGER PRIMARY KEY, entries INTEGER)')
+            db.execute('INSERT OR IGNORE INTO size VALUES (0, (SELECT COUNT(*) FROM results))')
+            db.execute(
+                'CREATE TRIGGER IF NOT EXISTS results_inserted AFTER INSERT ON results '
+                'BEGIN UPDATE size SET entries = entries + 1; END'
+            )
+            db.execute(
+                'CREATE TRIGGER IF NOT EXISTS results_deleted AFTER DELETE ON results '
+                'BEGIN UPDATE size SET entries = entries - 1; END'
+            )
+            db.execute('COMMIT')
+
+    def _connect(self):
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('PRAGMA synchronous=NORMAL')
+            self._local.db = db
+        return db
+
+    def get(self, key):
+        db = self._connect()
+        now = time.time()
+        row = db.execute(
+            'SELECT label, confidence, expires FROM results WHERE key = ?', (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        label, confidence, expires = row
+        if expires is not None and expires < now:
+            db.execute('DELETE FROM results WHERE key = ?', (key,))
+            return None
+        self._touch(key, now)
+        return label, confidence
+
+    def _touch(self, key, now):
+        with self._touch_lock:
+            self._touched[key] = now
+            if len(self._touched) < self.touch_batch and time.monotonic() < self._next_touch:
+                return
+        self._flush_touched()
+
+    def _flush_touched(self):
+        with self._touch_lock:
+            touched, self._touched = self._touched, {}
+            self._next_touch = time.monotonic() + self.touch_interval
+        if not touched:
+            return
+        db = self._connect()
+        db.execute('BEGIN')
+        db.executemany('UPDATE results SET used = ? WHERE key = ?',
+                       [(used, key) for key, used in touched.items()])
+        db.execute('COMMIT')
+
+    def set(self, key, value):
+        """Store value and return the number of entries evicted."""
+        db = self._connect()
+        now = time.time()
+        expires = now + self.ttl if self.ttl else None
+        label, confidence = value
+        # An upsert, unlike INSERT OR REPLACE, fires the insert trigger only for new keys
+        db.execute(
+            'INSERT INTO results VALUES (?, ?, ?, ?, ?) ON CONFLICT (key) DO UPDATE SET '
+            'label = excluded.label, confidence = excluded.confidence, '
+            'expires = excluded.expires, used = excluded.used',
+            (key, label, confidence, expires, now),
+        )
+        excess = len(self) - self.max_entries
+        if excess <= 0:
+            return 0
+        # Evict by the latest use, including hits not yet written
+        self._flush_touched()
+        db.execute(
+            'DELETE FROM results WHERE key IN '
+            '(SELECT key FROM results ORDER BY used LIMIT ?)', (excess,)
+        )
+        return excess
+
+    def clear(self):
+        self._connect().execute('DELETE FROM results')
+
+    def __len__(self):
+        return self._connect().execute('SELECT entries FROM size').fetchone()[0]
+
+
+class ClassificationCache:
+    """Caches (label, confidence) results keyed by text and model version.
+
+    If watch is given, the files are checked at most every check_interval
+    seconds and the cache is cleared as soon as any of them changes, so a
+    retrained model never shares entries with the one it replaced.
+    """
+
+    def __init__(self, backend, watch=(), check_interval=5.0):
+        self.backend = backend
+        self.watch = list(watch)
+        self.check_interval = check_interval
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._signature = self._watched_signature()
+        self._next_check = time.monotonic() + check_interval
+
+    def _watched_signature(self):
+        signature = []
+        for path in self.watch:
+            try:
+                stat = os.stat(path)
+                signature.append((stat.st_mtime_ns, stat.st_size))
+            except OSError:
+                signature.append(None)
+        return signature
+
+    def _check_watched(self):
+        if not self.watch or time.monotonic() < self._next_check:
+            return
+        self._next_check = time.monotonic() + self.check_interval
+        signature = self._watched_signature()
+        if signature != self._signature:
+            self._signature = signature
+            self.backend.clear()
+
+    def get(self, text, version):
+        self._check_watched()
+        value = self.backend.get(cache_key(text, version))
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def set(self, text, version, value):
+        self.evictions += self.backend.set(cache_key(text, version), value)
+
+    def clear(self):
+        self.backend.clear()
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'size': len(self.backend),
+        }
+
+
+class HistoryCache:
+    """Short-lived per-user cache of /history responses.
+
+    Entries are grouped by user so that all of a user's cached pages can be
+    dropped at once when they classify a message or give feedback. The cache
+    lives in one process: other workers keep serving their pages until the
+    ttl runs out, so it should stay a few seconds.
+    """
+
+    def __init__(self, ttl=5, max_users=1000):
+        self.ttl = ttl
+        self.max_users = max_users
+        self._users = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user, key):
+        with self._lock:
+            entry = self._users.get(user, {}).get(key)
+            if entry is None:
+                return None
+            value, expires = entry
+            if expires < time.monotonic():
+                del self._users[user][key]
+                return None
+            self._users.move_to_end(user)
+            return value
+
+    def set(self, user, key, value):
+        with self._lock:
+            self._users.setdefault(user, {})[key] = (value, time.monotonic() + self.ttl)
+            self._users.move_to_end(user)
+            while len(self._users) > self.max_users:
+                self._users.popitem(last=False)
+
+    def invalidate(self, user):
+        with self._lock:
+            self._users.pop(user, None)
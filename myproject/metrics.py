@@ -0,0 +1,131 @@
+"""Latency histograms and per-request stage timing.
+
+Metrics keeps Prometheus-style cumulative histograms in process memory and
+renders them in the Prometheus text format for /metrics. RequestTimer records
+how long each stage of a request took (parse, vectorize, predict, ...). Every
+gunicorn worker has its own registry, so scrape each worker or aggregate.
+"""
+import bisect
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+# Seconds; spans sub-millisecond scoring up to slow database round trips
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025,
+                   0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram:
+    """Thread-safe histogram with fixed upper bucket bounds."""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+    def snapshot(self):
+        """Return (cumulative bucket counts including +Inf, sum, count)."""
+        with self._lock:
+            counts, total, count = list(self.counts), self.sum, self.count
+        cumulative, running = [], 0
+        for value in counts:
+            running += value
+            cumulative.append(running)
+        return cumulative, total, count
+
+    def quantile(self, q):
+        """Estimate the q-quantile as the upper bound of its bucket."""
+        cumulative, _, count = self.snapshot()
+        if not count:
+            return math.nan
+        rank = q * count
+        for bound, seen in zip(self.buckets + (math.inf,), cumulative):
+            if seen >= rank:
+                return bound
+        return math.inf
+
+
+class Metrics:
+    """Registry of labelled histograms."""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self._histograms = {}
+        self._help = {}
+        self._lock = threading.Lock()
+
+    def histogram(self, name, help_text='', **labels):
+        key = (name, tuple(sorted(labels.items())))
+        histogram = self._histograms.get(key)
+        if histogram is None:
+            with self._lock:
+                histogram = self._histograms.setdefault(key, Histogram(self.buckets))
+                if help_text:
+                    self._help.setdefault(name, help_text)
+        return histogram
+
+    def observe(self, name, value, **labels):
+        self.histogram(name, **labels).observe(value)
+
+    def collect(self, name):
+        """Return (labels dict, histogram) pairs of the metric name."""
+        with self._lock:
+            histograms = sorted(self._histograms.items(), key=lambda item: item[0])
+        return [(dict(labels), histogram) for (metric, labels), histogram in histograms
+                if metric == name]
+
+    def render(self):
+        """Render every histogram in the Prometheus text exposition format."""
+        with self._lock:
+            histograms = sorted(self._histograms.items(), key=lambda item: item[0])
+        lines = []
+        for name in sorted({name for (name, _), _ in histograms}):
+            if name in self._help:
+                lines.append(f'# HELP {name} {self._help[name]}')
+            lines.append(f'# TYPE {name} histogram')
+            for (metric, labels), histogram in histograms:
+                if metric != name:
+                    continue
+                cumulative, total, count = histogram.snapshot()
+                for bound, seen in zip(histogram.buckets + (math.inf,), cumulative):
+                    le = '+Inf' if bound == math.inf else repr(bound)
+                    lines.append(f'{name}_bucket{format_labels(labels + (("le", le),))} {seen}')
+                lines.append(f'{name}_sum{format_labels(labels)} {total}')
+                lines.append(f'{name}_count{format_labels(labels)} {count}')
+        return '\n'.join(lines) + '\n'
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"') for _, value in labels)
+    return '{' + ','.join(f'{key}="{value}"' for (key, _), value in zip(labels, escaped)) + '}'
+
+
+class RequestTimer:
+    """Collects the duration of the named stages of one request."""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.stages = {}
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] = self.stages.get(name, 0.0) + time.perf_counter() - start
+
+    def elapsed(self):
+        return time.perf_counter() - self.start
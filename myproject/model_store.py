@@ -0,0 +1,242 @@
+"""Memory-mappable model store.
+
+The pickles need scikit-learn (and scipy) just to be unpickled, and every
+gunicorn worker ends up with its own copy of the vocabulary dict and model
+arrays. export_store writes the compiled scorer as plain .npy files instead:
+the vocabulary becomes a sorted array of terms searched with np.searchsorted,
+and every array is opened with mmap_mode='r', so workers share one copy
+through the page cache and loading only needs NumPy.
+
+Build the store from the pickles with:
+
+    python model_store.py --classifier spam_classifier.pkl \
+        --vectorizer vectorizer.pkl --output model_store
+
+Retrained models are published to a registry directory holding one store per
+version plus a CURRENT file naming the active one (see publish). Running
+workers poll CURRENT and swap to the new version without a restart.
+"""
+import argparse
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+
+import numpy as np
+
+if __package__:
+    from .cache import model_version
+    from .scorer import CompiledScorer
+else:
+    from cache import model_version
+    from scorer import CompiledScorer
+
+logger = logging.getLogger(__name__)
+
+STORE_ARRAYS = ['terms', 'columns', 'idf', 'log_prob', 'class_log_prior', 'classes']
+
+
+class SortedVocabulary:
+    """Vocabulary stored as sorted terms plus the column of each term."""
+
+    def __init__(self, terms, columns):
+        self.terms = terms
+        self.columns = columns
+
+    def lookup(self, tokens):
+        """Return the columns of the tokens found in the vocabulary."""
+        # Tokens longer than the longest term cannot match, and would make the
+        # fixed-width probe array as wide as the longest token in the text
+        max_length = self.terms.dtype.itemsize // 4
+        tokens = [token for token in tokens if len(token) <= max_length]
+        if not tokens:
+            return np.empty(0, dtype=np.intp)
+        probe = np.array(tokens, dtype=self.terms.dtype)
+        positions = np.searchsorted(self.terms, probe)
+        np.minimum(positions, len(self.terms) - 1, out=positions)
+        found = self.terms[positions] == probe
+        return self.columns[positions[found]].astype(np.intp)
+
+
+def export_store(scorer, directory, version, **extra_meta):
+    """Write a compiled scorer to directory as .npy files.
+
+    meta.json is written last, so a directory without it is incomplete.
+    extra_meta is stored in meta.json alongside the version.
+    """
+    os.makedirs(directory, exist_ok=True)
+    term_index = scorer.vocabulary.term_index
+    terms = np.array(sorted(term_index))
+    arrays = {
+        'terms': terms,
+        'columns': np.array([term_index[t] for t in terms], dtype=np.int32),
+        'idf': scorer.idf,
+        'log_prob': np.ascontiguousarray(scorer.log_prob),
+        'class_log_prior': scorer.class_log_prior,
+        'classes': scorer.classes,
+    }
+    for name, array in arrays.items():
+        np.save(os.path.join(directory, f'{name}.npy'), array)
+
+    meta = {**extra_meta, 'version': version, 'token_pattern': scorer.token_pattern}
+    tmp_path = os.path.join(directory, 'meta.json.tmp')
+    with open(tmp_path, 'w') as f:
+        json.dump(meta, f)
+    os.replace(tmp_path, os.path.join(directory, 'meta.json'))
+
+
+def read_meta(directory):
+    with open(os.path.join(directory, 'meta.json')) as f:
+        return json.load(f)
+
+
+def load_store(directory, mmap=True):
+    """Load a scorer written by export_store; returns (version, scorer)."""
+    meta = read_meta(directory)
+    mmap_mode = 'r' if mmap else None
+    arrays = {name: np.load(os.path.join(directory, f'{name}.npy'), mmap_mode=mmap_mode)
+              for name in STORE_ARRAYS}
+    scorer = CompiledScorer(
+        vocabulary=SortedVocabulary(arrays['terms'], arrays['columns']),
+        idf=arrays['idf'],
+        log_prob=arrays['log_prob'],
+        class_log_prior=arrays['class_log_prior'],
+        classes=arrays['classes'],
+        token_pattern=meta['token_pattern'],
+    )
+    return meta['version'], scorer
+
+
+def compile_pickles(classifier_path, vectorizer_path):
+    """Load the pickles (needs scikit-learn); returns (version, scorer)."""
+    import joblib
+
+    scorer = CompiledScorer.from_sklearn(joblib.load(vectorizer_path), joblib.load(classifier_path))
+    return model_version([classifier_path, vectorizer_path]), scorer
+
+
+def current_version(registry_dir):
+    """Return the version named by the registry's CURRENT file, or None."""
+    try:
+        with open(os.path.join(registry_dir, 'CURRENT')) as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def publish(registry_dir, version, scorer, classifier=None, trained_labels=None, **extra_meta):
+    """Add a model version to the registry and make it the current one.
+
+    The store is written to a temporary directory and renamed into place, then
+    CURRENT is replaced atomically, so readers only ever see complete models.
+    The fitted classifier, if given, is kept alongside for further training,
+    together with trained_labels, the label it learned each feedback row with.
+    """
+    os.makedirs(registry_dir, exist_ok=True)
+    target = os.path.join(registry_dir, version)
+    if not os.path.exists(os.path.join(target, 'meta.json')):
+        staging = f"{target}.tmp-{os.getpid()}"
+        shutil.rmtree(staging, ignore_errors=True)
+        if classifier is not None:
+            import joblib
+
+            os.makedirs(staging)
+            joblib.dump(classifier, os.path.join(staging, 'spam_classifier.pkl'))
+            if trained_labels is not None:
+                joblib.dump(trained_labels, os.path.join(staging, 'trained_labels.pkl'))
+        export_store(scorer, staging, version, **extra_meta)
+        shutil.rmtree(target, ignore_errors=True)
+        os.rename(staging, target)
+
+    tmp_path = os.path.join(registry_dir, f'CURRENT.tmp-{os.getpid()}')
+    with open(tmp_path, 'w') as f:
+        f.write(version)
+    os.replace(tmp_path, os.path.join(registry_dir, 'CURRENT'))
+
+
+class LazyModel:
+    """Loads the scorer on first use and hot-swaps published versions.
+
+    If registry_dir has a CURRENT version, that version is served and CURRENT
+    is re-read at most every check_interval seconds; a new version is loaded
+    by the one request that notices it while the others keep using the old
+    model, and the (version, scorer) pair is then replaced in one assignment.
+
+    Without a registry, the store is used when its version matches the
+    pickles (or when the pickles are absent); otherwise the pickles are
+    compiled directly.
+    """
+
+    def __init__(self, store_dir, classifier_path, vectorizer_path,
+                 registry_dir=None, check_interval=10.0):
+        self.store_dir = store_dir
+        self.classifier_path = classifier_path
+        self.vectorizer_path = vectorizer_path
+        self.registry_dir = registry_dir
+        self.check_interval = check_interval
+        self._loaded = None
+        self._next_check = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def version(self):
+        """Version currently served, or None if nothing is loaded yet."""
+        loaded = self._loaded
+        return loaded[0] if loaded else None
+
+    def get(self):
+        """Return (version, scorer), loading them on the first call."""
+        loaded = self._loaded
+        if loaded is None:
+            with self._lock:
+                if self._loaded is None:
+                    self._loaded = self._load()
+                    self._next_check = time.monotonic() + self.check_interval
+                loaded = self._loaded
+        elif self.registry_dir and time.monotonic() >= self._next_check:
+            # Only one request checks; the rest carry on with the old model
+            if self._lock.acquire(blocking=False):
+                try:
+                    self._next_check = time.monotonic() + self.check_interval
+                    version = current_version(self.registry_dir)
+                    if version and version != loaded[0]:
+                        self._loaded = load_store(os.path.join(self.registry_dir, version))
+                        logger.info("Switched model from %s to %s", loaded[0], version)
+                except Exception:
+                    logger.exception("Failed to load published model, keeping %s", loaded[0])
+                finally:
+                    self._lock.release()
+                loaded = self._loaded
+        return loaded
+
+    def _load(self):
+        version = current_version(self.registry_dir) if self.registry_dir else None
+        if version:
+            return load_store(os.path.join(self.registry_dir, version))
+
+        pickles = [self.classifier_path, self.vectorizer_path]
+        have_pickles = all(os.path.exists(path) for path in pickles)
+        if os.path.exists(os.path.join(self.store_dir, 'meta.json')):
+            version, scorer = load_store(self.store_dir)
+            if not have_pickles or version == model_version(pickles):
+                return version, scorer
+            logger.warning("Model store %s is stale, loading the pickles instead", self.store_dir)
+        return compile_pickles(self.classifier_path, self.vectorizer_path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Export the pickled model as a memory-mappable store.')
+    parser.add_argument('--classifier', default='spam_classifier.pkl')
+    parser.add_argument('--vectorizer', default='vectorizer.pkl')
+    parser.add_argument('--output', default='model_store')
+    args = parser.parse_args()
+
+    version, scorer = compile_pickles(args.classifier, args.vectorizer)
+    export_store(scorer, args.output, version)
+    print(f"Exported model {version} to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
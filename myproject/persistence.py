@@ -0,0 +1,417 @@
+"""Write-behind persistence of classification results.
+
+Requests hand their rows to a WriteBehindQueue and return immediately; a
+background thread inserts them into Supabase in micro-batches. Rows get a
+client-side UUID up front so callers can reference them (e.g. from /feedback)
+before they reach the database. Batches that still fail after retrying are
+appended to a local JSON-lines spill file and replayed once the database
+accepts writes again. Rows are written with an upsert that ignores ids
+already present, so retrying an insert that committed but timed out, or
+replaying it from the spill file, is harmless.
+
+Updates to rows that may already have been written (feedback given while a
+row was in flight, or after it was spilled) are never folded into the row,
+which the upsert would ignore, but spilled as separate entries and applied
+with an UPDATE once the rows of the spill file have been replayed.
+"""
+import glob
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - not available on Windows
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+
+class QueueFull(Exception):
+    """Raised when the queue is full and no spill file is configured."""
+
+
+class WriteBehindQueue:
+    """Bounded queue of rows flushed to a Supabase table by a background thread.
+
+    A batch is written once batch_size rows are queued or flush_interval
+    seconds have passed. Failed inserts are retried max_retries times with
+    exponential backoff starting at backoff seconds. on_flushed, if given, is
+    called with every batch once it has been written. If metrics is given, the
+    duration of every insert is observed as db_insert_duration_seconds.
+
+    A group of records queued together is always written in one upsert,
+    even if it holds more than batch_size records.
+    """
+
+    def __init__(self, client, table='classified_messages', batch_size=100,
+                 flush_interval=0.5, max_queue=10000, spill_path=None,
+                 max_retries=3, backoff=0.5, on_flushed=None, metrics=None):
+        self.client = client
+        self.table = table
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_queue = max_queue
+        self.spill_path = spill_path
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.on_flushed = on_flushed
+        self.metrics = metrics
+
+        self.written = 0
+        self.spilled = 0
+        # Groups of records, as queued by submit_many
+        self._buffer = deque()
+        self._queued = 0
+        self._in_flight = {}
+        self._amendments = {}
+        self._cond = threading.Condition()
+        self._spill_lock = threading.Lock()
+        self._closing = False
+        self._thread = None
+        self._pid = None
+        self._orphans_replayed = False
+
+    def _ensure_started(self):
+        # Threads do not survive a fork, so pre-forked workers start their own
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        self._closing = False
+        self._thread = threading.Thread(target=self._run, name='write-behind', daemon=True)
+        self._thread.start()
+
+    def submit(self, record):
+        """Queue one record and return its id."""
+        return self.submit_many([record])[0]
+
+    def submit_many(self, records):
+        """Queue records, assigning a UUID to any without an id.
+
+        Returns the ids in order. If the queue is full the records go straight
+        to the spill file, or QueueFull is raised when there is none.
+        """
+        records = [dict(record) for record in records]
+        for record in records:
+            record.setdefault('id', str(uuid.uuid4()))
+
+        with self._cond:
+            self._ensure_started()
+            if self._queued + len(records) > self.max_queue:
+                if not self.spill_path:
+                    raise QueueFull(f"Write queue is full ({self.max_queue} records)")
+                self._spill(records)
+            else:
+                self._buffer.append(records)
+                self._queued += len(records)
+                if self._queued >= self.batch_size:
+                    self._cond.notify_all()
+        return [record['id'] for record in records]
+
+    def update_pending(self, record_id, fields):
+        """Apply fields to a record that has not been written yet.
+
+        Returns False if the record is not pending, i.e. it is already in the
+        database (or was spilled) and must be updated there instead.
+        """
+        with self._cond:
+            for group in self._buffer:
+                for record in group:
+                    if record['id'] == record_id:
+                        record.update(fields)
+                        return True
+            if record_id in self._in_flight:
+                self._amendments.setdefault(record_id, {}).update(fields)
+                return True
+        return False
+
+    def update(self, record_id, fields):
+        """Apply fields to a record wherever it is.
+
+        Pending records are updated before they are written and written ones
+        in the database. For a record waiting in a spill file the update is
+        spilled too and applied once the record has been replayed. Returns
+        False if the record was not found.
+        """
+        return self.update_pending(record_id, fields) or self._update_stored(record_id, fields)
+
+    def pending(self):
+        with self._cond:
+            return self._queued + len(self._in_flight)
+
+    def flush(self, timeout=None):
+        """Block until every queued record has been written or spilled."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            self._cond.notify_all()
+            while self._buffer or self._in_flight:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+        return True
+
+    def close(self, timeout=10):
+        """Drain the queue and stop the background thread.
+
+        Records still queued or in flight after timeout seconds (e.g. while
+        the database is down) are spilled rather than lost with the thread.
+        """
+        with self._cond:
+            if self._thread is None or self._pid != os.getpid():
+                return
+            self._closing = True
+            self._cond.notify_all()
+        self._thread.join(timeout)
+        if self._thread.is_alive():
+            with self._cond:
+                # In-flight batches may still commit; writes are idempotent,
+                # so replaying them later is harmless
+                remaining = list(self._in_flight.values())
+                remaining.extend(record for group in self._buffer for record in group)
+                amendments = dict(self._amendments)
+                self._buffer.clear()
+                self._queued = 0
+            if remaining:
+                logger.warning("Write queue did not drain in %ss, spilling %d records",
+                               timeout, len(remaining))
+                self._spill(remaining, amendments)
+        self._thread = None
+
+    def stats(self):
+        return {'pending': self.pending(), 'written': self.written, 'spilled': self.spilled}
+
+    def _run(self):
+        self._replay_spill()
+        while True:
+            with self._cond:
+                if self._queued < self.batch_size and not self._closing:
+                    self._cond.wait(self.flush_interval)
+                if not self._buffer:
+                    if self._closing:
+                        return
+                    continue
+                batch = []
+                while self._buffer and (not batch or len(batch) + len(self._buffer[0]) <= self.batch_size):
+                    batch.extend(self._buffer.popleft())
+                self._queued -= len(batch)
+                self._in_flight.update((record['id'], record) for record in batch)
+
+            written = self._write(batch)
+            ids = {record['id'] for record in batch}
+
+            # Records stay in flight until updates made to them meanwhile
+            # (e.g. feedback) have been applied or spilled along with them
+            while True:
+                with self._cond:
+                    amendments = {record_id: self._amendments.pop(record_id)
+                                  for record_id in ids & self._amendments.keys()}
+                    if not written or not amendments:
+                        if not written:
+                            self._spill(batch, amendments)
+                        for record_id in ids:
+                            del self._in_flight[record_id]
+                        self._cond.notify_all()
+                        break
+                self._apply_updates(amendments)
+
+            if written:
+                self._replay_spill()
+
+    def _write(self, batch):
+        for attempt in range(self.max_retries + 1):
+            start = time.perf_counter()
+            try:
+                self.client.table(self.table) \
+                    .upsert(batch, on_conflict='id', ignore_duplicates=True).execute()
+                self.written += len(batch)
+                self._observe(start, 'ok')
+                break
+            except Exception as e:
+                self._observe(start, 'error')
+                logger.warning("Insert of %d records failed (attempt %d): %s",
+                               len(batch), attempt + 1, e)
+                if attempt < self.max_retries:
+                    time.sleep(self.backoff * 2 ** attempt)
+        else:
+            return False
+
+        if self.on_flushed is not None:
+            try:
+                self.on_flushed(batch)
+            except Exception as e:
+                logger.error("on_flushed callback failed: %s", e)
+        return True
+
+    def _observe(self, start, outcome):
+        if self.metrics is not None:
+            self.metrics.observe('db_insert_duration_seconds', time.perf_counter() - start,
+                                 table=self.table, outcome=outcome)
+
+    def _update_row(self, record_id, fields):
+        """Update a record in the database; returns False if it is not there."""
+        response = self.client.table(self.table).update(fields).eq('id', record_id).execute()
+        return bool(response.data)
+
+    def _update_stored(self, record_id, fields):
+        try:
+            if self._update_row(record_id, fields):
+                return True
+        except Exception:
+            if not self._spill_update(record_id, fields):
+                raise
+            return True
+        if self._spill_update(record_id, fields):
+            return True
+        # A replay may have written the record since it was looked for
+        return self._update_row(record_id, fields)
+
+    def _apply_updates(self, updates):
+        """Apply updates to written records, spilling those that fail."""
+        for record_id, fields in updates.items():
+            try:
+                if self._update_stored(record_id, fields):
+                    continue
+                logger.error("Dropping update to %s: record not found", record_id)
+            except Exception as e:
+                logger.warning("Failed to apply update to %s: %s", record_id, e)
+                self._spill([], {record_id: fields})
+
+    def _spill(self, records, updates=None):
+        """Append records, then updates to them, to the spill file."""
+        entries = [{'row': record} for record in records]
+        entries += [{'update': record_id, 'fields': fields}
+                    for record_id, fields in (updates or {}).items()]
+        if not entries:
+            return
+        if not self.spill_path:
+            logger.error("Dropping %d records and %d updates: database unavailable and no spill file",
+                         len(records), len(entries) - len(records))
+            return
+        with self._locked_spill():
+            self._append(entries)
+            self.spilled += len(records)
+
+    def _append(self, entries):
+        with open(self.spill_path, 'a', encoding='utf-8') as f:
+            for entry in entries:
+                f.write(json.dumps(entry) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _spill_update(self, record_id, fields):
+        """Spill an update if its record is in a spill file; returns whether it was."""
+        if not self.spill_path:
+            return False
+        with self._locked_spill():
+            if not self._is_spilled(record_id):
+                return False
+            self._append([{'update': record_id, 'fields': fields}])
+        return True
+
+    def _is_spilled(self, record_id):
+        """Whether the record is in the spill file or one being replayed."""
+        needle = json.dumps(record_id)
+        for path in [self.spill_path] + self._replay_files():
+            try:
+                with open(path, encoding='utf-8') as f:
+                    for line in f:
+                        # Only parse the lines that can hold the id
+                        if needle in line and json.loads(line).get('row', {}).get('id') == record_id:
+                            return True
+            except FileNotFoundError:
+                continue
+        return False
+
+    def _replay_files(self):
+        return glob.glob(f"{glob.escape(self.spill_path)}.*.replay")
+    @contextmanager
+    def _locked_spill(self):
+        """Hold the spill file against other threads and worker processes.
+
+        Appending and taking the file over for replay both happen under an
+        exclusive flock on a companion .lock file, so no worker appends to a
+        file another one has already moved away and read.
+        """
+        with self._spill_lock:
+            if fcntl is None:
+                yield
+                return
+            with open(f"{self.spill_path}.lock", 'a') as lock:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _replay_spill(self):
+        """Replay the spill file, and once per process the files left by
+        workers that died while replaying."""
+        if not self.spill_path:
+            return
+        if not self._orphans_replayed:
+            self._orphans_replayed = True
+            for path in self._replay_files():
+                pid = path[len(self.spill_path) + 1:-len('.replay')]
+                if pid.isdigit() and (int(pid) == os.getpid() or not _process_exists(int(pid))):
+                    self._take_over(path)
+        self._take_over(self.spill_path)
+
+    def _take_over(self, path):
+        replaying = f"{self.spill_path}.{os.getpid()}.replay"
+        try:
+            with self._locked_spill():
+                os.replace(path, replaying)
+        except FileNotFoundError:
+            # Another worker picked it up first
+            return
+        self._replay(replaying)
+        os.remove(replaying)
+
+    def _replay(self, path):
+        """Re-insert spilled records a batch at a time, then apply the spilled
+        updates; anything that fails again is re-spilled."""
+        batch, updates = [], {}
+        failed = False
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                entry = json.loads(line)
+                if 'update' in entry:
+                    updates.setdefault(entry['update'], {}).update(entry['fields'])
+                    continue
+                batch.append(entry['row'])
+                if len(batch) >= self.batch_size:
+                    failed = self._replay_batch(batch, failed)
+                    batch = []
+        failed = self._replay_batch(batch, failed)
+        if failed:
+            self._spill([], updates)
+        else:
+            self._apply_updates(updates)
+
+    def _replay_batch(self, batch, failed):
+        """Write batch unless an earlier one failed; returns whether any failed."""
+        if batch and (failed or not self._write(batch)):
+            self._spill(batch)
+            return True
+        return failed
+
+
+def _process_exists(pid):
+    if os.name != 'posix':
+        # os.kill cannot probe a process elsewhere; assume it is still running
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
@@ -0,0 +1,231 @@
+"""Incremental retraining from user feedback.
+
+Rows of classified_messages with feedback are streamed in chunks, in the
+order the feedback was given (feedback_at, set by /feedback). Each row's true label is its stored label, flipped
+when the user said the classification was wrong. A deterministic fraction of
+the rows (by id hash) is held out; the rest update a copy of the current
+MultinomialNB with partial_fit, so nothing is refitted from scratch. The
+vectorizer, and therefore the vocabulary, stays fixed.
+
+Users can change their feedback, which streams the row again. Each version
+keeps the label it learned every row with (trained_labels.pkl), so a row
+seen with the same label is skipped, and one whose label flipped has its
+old counts subtracted before it is learned again.
+
+The new model is published to the registry only if its accuracy on the
+holdout is at least that of the current model. Running workers pick it up
+within MODEL_CHECK_INTERVAL seconds. Each published version records the
+(feedback_at, id) of the last row it was trained on, so the next run only
+streams feedback given since, including feedback on old messages. Feedback
+from the last --settle seconds is left for the next run, since rows still
+in a worker's write-behind queue reach the table after their feedback_at.
+
+    python retrain.py --registry models
+"""
+import argparse
+import copy
+import hashlib
+import os
+import sys
+from datetime import datetime, timedelta, timezone
+
+import joblib
+import numpy as np
+
+if __package__:
+    from .cache import model_version
+    from .model_store import current_version, publish, read_meta
+    from .scorer import CompiledScorer, fitted_idf
+else:
+    from cache import model_version
+    from model_store import current_version, publish, read_meta
+    from scorer import CompiledScorer, fitted_idf
+
+FEEDBACK_COLUMNS = 'id,feedback_at,message,label,is_classification_correct'
+
+
+def feedback_rows(client, since=None, until=None, chunk_size=500):
+    """Yield chunks of rows with feedback given after the (feedback_at, id)
+    since and, if until is given, before the feedback_at until."""
+    cursor = since
+    while True:
+        query = client.table('classified_messages') \
+            .select(FEEDBACK_COLUMNS) \
+            .not_.is_('is_classification_correct', 'null') \
+            .not_.is_('feedback_at', 'null')
+        if until:
+            query = query.lt('feedback_at', until)
+        if cursor:
+            feedback_at, row_id = cursor
+            query = query.or_(
+                f'feedback_at.gt."{feedback_at}",'
+                f'and(feedback_at.eq."{feedback_at}",id.gt."{row_id}")'
+            )
+        rows = query.order('feedback_at').order('id').limit(chunk_size).execute().data
+        if not rows:
+            return
+        yield rows
+        if len(rows) < chunk_size:
+            return
+        cursor = (rows[-1]['feedback_at'], rows[-1]['id'])
+
+
+def true_label(row):
+    """Return 1 for spam, 0 for ham, taking the user's feedback into account."""
+    spam = row['label'] == 'Spam'
+    if not row['is_classification_correct']:
+        spam = not spam
+    return int(spam)
+
+
+def is_holdout(row_id, fraction):
+    digest = hashlib.sha256(str(row_id).encode('utf-8')).digest()
+    return int.from_bytes(digest[:4], 'big') < fraction * 2 ** 32
+
+
+def classifier_version(classifier, vectorizer_path):
+    """Content hash of the fitted classifier counts and the vectorizer."""
+    digest = hashlib.sha256(model_version([vectorizer_path]).encode('ascii'))
+    digest.update(np.ascontiguousarray(classifier.class_count_).tobytes())
+    digest.update(np.ascontiguousarray(classifier.feature_count_).tobytes())
+    return digest.hexdigest()[:16]
+
+
+def forget(classifier, features, labels):
+    """Subtract rows learned with labels from a MultinomialNB's counts.
+
+    Only the counts change; the rows must be learned again with partial_fit,
+    which recomputes the probabilities from them.
+    """
+    labels = np.asarray(labels)
+    for label in np.unique(labels):
+        index = np.flatnonzero(classifier.classes_ == label)[0]
+        rows = labels == label
+        classifier.feature_count_[index] -= np.asarray(features[rows].sum(axis=0)).ravel()
+        classifier.class_count_[index] -= rows.sum()
+    # Float sums of the same rows may differ in the last bit
+    np.maximum(classifier.feature_count_, 0, out=classifier.feature_count_)
+
+
+def retrain(client, classifier, vectorizer, since=None, until=None, chunk_size=500,
+            holdout_fraction=0.1, trained_labels=None):
+    """Update a copy of classifier with the feedback streamed from client.
+
+    trained_labels maps the id of each row classifier has learned to the
+    label it learned it with, and is updated in place with the rows learned
+    now. Returns the new classifier and a report with the number of training
+    rows (of which corrected were relearned with a new label), holdout rows,
+    both models' holdout accuracy and the watermark (the (feedback_at, id) of
+    the last row read).
+    """
+    updated = copy.deepcopy(classifier)
+    trained_labels = {} if trained_labels is None else trained_labels
+    holdout_texts, holdout_labels = [], []
+    trained = corrected = 0
+    watermark = since
+
+    for rows in feedback_rows(client, since=since, until=until, chunk_size=chunk_size):
+        train_texts, train_labels = [], []
+        forget_texts, forget_labels = [], []
+        for row in rows:
+            if not row['message']:
+                continue
+            label = true_label(row)
+            if is_holdout(row['id'], holdout_fraction):
+                holdout_texts.append(row['message'])
+                holdout_labels.append(label)
+                continue
+            previous = trained_labels.get(row['id'])
+            if previous == label:
+                continue
+            if previous is not None:
+                forget_texts.append(row['message'])
+                forget_labels.append(previous)
+            train_texts.append(row['message'])
+            train_labels.append(label)
+            trained_labels[row['id']] = label
+        if forget_texts:
+            forget(updated, vectorizer.transform(forget_texts), forget_labels)
+            corrected += len(forget_texts)
+        if train_texts:
+            updated.partial_fit(vectorizer.transform(train_texts), train_labels)
+            trained += len(train_texts)
+        watermark = [rows[-1]['feedback_at'], rows[-1]['id']]
+
+    report = {'trained': trained, 'corrected': corrected, 'holdout': len(holdout_texts),
+              'watermark': watermark, 'old_accuracy': None, 'new_accuracy': None}
+    if holdout_texts:
+        features = vectorizer.transform(holdout_texts)
+        report['old_accuracy'] = float(classifier.score(features, holdout_labels))
+        report['new_accuracy'] = float(updated.score(features, holdout_labels))
+    return updated, report
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Retrain the spam classifier from user feedback.')
+    parser.add_argument('--registry', default=os.getenv('MODEL_REGISTRY_DIR', 'models'))
+    parser.add_argument('--classifier', default='spam_classifier.pkl',
+                        help='starting model when the registry is empty')
+    parser.add_argument('--vectorizer', default='vectorizer.pkl')
+    parser.add_argument('--chunk-size', type=int, default=500)
+    parser.add_argument('--holdout-fraction', type=float, default=0.1)
+    parser.add_argument('--min-holdout', type=int, default=20)
+    parser.add_argument('--settle', type=float, default=600,
+                        help='seconds of the most recent feedback left for the next run')
+    parser.add_argument('--tolerance', type=float, default=0.0,
+                        help='accuracy drop on the holdout that is still accepted')
+    parser.add_argument('--dry-run', action='store_true')
+    args = parser.parse_args()
+
+    from dotenv import load_dotenv
+    from supabase import create_client
+
+    load_dotenv()
+    client = create_client(os.getenv('SUPABASE_URL'), os.getenv('SUPABASE_KEY'))
+
+    vectorizer = joblib.load(args.vectorizer)
+    vectorizer.idf_ = fitted_idf(vectorizer)
+
+    parent = current_version(args.registry)
+    if parent:
+        classifier = joblib.load(os.path.join(args.registry, parent, 'spam_classifier.pkl'))
+        since = read_meta(os.path.join(args.registry, parent)).get('trained_through')
+        labels_path = os.path.join(args.registry, parent, 'trained_labels.pkl')
+        trained_labels = joblib.load(labels_path) if os.path.exists(labels_path) else {}
+    else:
+        classifier = joblib.load(args.classifier)
+        parent = model_version([args.classifier, args.vectorizer])
+        since = None
+        trained_labels = {}
+
+    until = (datetime.now(timezone.utc) - timedelta(seconds=args.settle)).isoformat()
+    updated, report = retrain(client, classifier, vectorizer, since=since, until=until,
+                              chunk_size=args.chunk_size, holdout_fraction=args.holdout_fraction,
+                              trained_labels=trained_labels)
+    print(f"Model {parent}: trained on {report['trained']} rows ({report['corrected']} relabelled), "
+          f"{report['holdout']} held out, "
+          f"holdout accuracy {report['old_accuracy']} -> {report['new_accuracy']}")
+
+    if not report['trained']:
+        print("No new feedback, nothing to publish.")
+        return 0
+    if report['holdout'] < args.min_holdout:
+        print(f"Not publishing: fewer than {args.min_holdout} holdout rows.")
+        return 1
+    if report['new_accuracy'] + args.tolerance < report['old_accuracy']:
+        print("Not publishing: the retrained model is less accurate on the holdout.")
+        return 1
+    if args.dry_run:
+        return 0
+
+    version = classifier_version(updated, args.vectorizer)
+    publish(args.registry, version, CompiledScorer.from_sklearn(vectorizer, updated),
+            classifier=updated, trained_labels=trained_labels, parent=parent,
+            trained_through=report['watermark'],
+            holdout_accuracy=report['new_accuracy'])
+    print(f"Published model {version}.")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
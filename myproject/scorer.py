@@ -0,0 +1,141 @@
+"""Compiled spam scorer.
+
+The fitted TfidfVectorizer and MultinomialNB are flattened into a handful of
+NumPy arrays once at startup, so classifying a message only needs a regex
+tokenizer, a vocabulary lookup per token and a tiny dense dot product. This skips
+sklearn's per-call validation and CSR construction, which dominate the cost of
+classifying short messages.
+
+Only the configuration the app is trained with is supported (word analyzer,
+unigrams, lowercase, l2 norm, no sublinear tf); anything else is
+rejected at compile time rather than silently scoring differently.
+"""
+import re
+
+import numpy as np
+
+# Label names used throughout the API, keyed by the classifier's class value
+LABELS = {0: "Ham", 1: "Spam"}
+
+
+def fitted_idf(vectorizer):
+    """Return the idf weights of a fitted TfidfVectorizer.
+
+    Pickles written by scikit-learn < 1.3 only store the idf as a sparse
+    diagonal matrix; newer versions no longer read it and silently skip the
+    idf weighting, so it is recovered here explicitly.
+    """
+    tfidf = vectorizer._tfidf
+    if hasattr(tfidf, 'idf_'):
+        return np.asarray(tfidf.idf_, dtype=np.float64)
+    return np.asarray(tfidf._idf_diag.diagonal(), dtype=np.float64)
+
+
+class DictVocabulary:
+    """Vocabulary backed by the vectorizer's term -> column dict."""
+
+    def __init__(self, term_index):
+        self.term_index = term_index
+
+    def lookup(self, tokens):
+        """Return the columns of the tokens found in the vocabulary."""
+        columns = map(self.term_index.get, tokens)
+        return np.fromiter((c for c in columns if c is not None), dtype=np.intp)
+
+
+class CompiledScorer:
+    """Scores messages with the same maths as the sklearn pipeline.
+
+    vocabulary maps tokens to columns (see DictVocabulary), idf holds the idf
+    weight per column, log_prob the per-class feature log probabilities with
+    shape (n_features, n_classes) and class_log_prior the per-class priors.
+    """
+
+    def __init__(self, vocabulary, idf, log_prob, class_log_prior, classes,
+                 token_pattern=r"(?u)\b\w\w+\b"):
+        self.vocabulary = vocabulary
+        self.token_pattern = token_pattern
+        # asarray keeps memory-mapped arrays mapped instead of copying them
+        self.idf = np.asarray(idf, dtype=np.float64)
+        self.log_prob = np.asarray(log_prob, dtype=np.float64)
+        self.class_log_prior = np.asarray(class_log_prior, dtype=np.float64)
+        self.classes = np.asarray(classes)
+        self.labels = [LABELS.get(int(c), str(c)) for c in classes]
+        self._tokenize = re.compile(token_pattern).findall
+
+    @classmethod
+    def from_sklearn(cls, vectorizer, classifier):
+        """Compile a fitted TfidfVectorizer and MultinomialNB into a scorer."""
+        params = vectorizer.get_params()
+        expected = {
+            'analyzer': 'word',
+            'ngram_range': (1, 1),
+            'lowercase': True,
+            'preprocessor': None,
+            'tokenizer': None,
+            'strip_accents': None,
+            'stop_words': None,
+            'binary': False,
+            'norm': 'l2',
+            'use_idf': True,
+            'sublinear_tf': False,
+        }
+        unsupported = {k: params[k] for k, v in expected.items() if params[k] != v}
+        if unsupported:
+            raise ValueError(f"Unsupported vectorizer settings: {unsupported}")
+
+        term_index = {term: int(column) for term, column in vectorizer.vocabulary_.items()}
+        return cls(
+            vocabulary=DictVocabulary(term_index),
+            idf=fitted_idf(vectorizer),
+            log_prob=np.ascontiguousarray(classifier.feature_log_prob_.T),
+            class_log_prior=classifier.class_log_prior_,
+            classes=classifier.classes_,
+            token_pattern=params['token_pattern'],
+        )
+
+    def _features(self, text):
+        """Return the (columns, l2-normalised tf-idf weights) of one text."""
+        columns, counts = np.unique(self.vocabulary.lookup(self._tokenize(text.lower())),
+                                    return_counts=True)
+        weights = counts * self.idf[columns]
+        norm = np.sqrt(np.dot(weights, weights))
+        if norm > 0:
+            weights /= norm
+        return columns, weights
+
+    def features(self, texts):
+        """Vectorize texts into flat (rows, columns, weights) arrays.
+
+        This is the tf-idf matrix in coordinate form, one entry per distinct
+        known token of each text.
+        """
+        per_text = [self._features(text) for text in texts]
+        rows = np.repeat(np.arange(len(per_text)), [len(c) for c, _ in per_text])
+        columns = np.concatenate([c for c, _ in per_text]) if per_text else np.empty(0, np.intp)
+        weights = np.concatenate([w for _, w in per_text]) if per_text else np.empty(0)
+        return rows, columns, weights
+
+    def joint_log_likelihood(self, texts, features=None):
+        """Return the (n_texts, n_classes) joint log likelihood matrix."""
+        rows, columns, weights = self.features(texts) if features is None else features
+        contributions = weights[:, None] * self.log_prob[columns]
+        jll = np.empty((len(texts), self.log_prob.shape[1]))
+        for k in range(jll.shape[1]):
+            jll[:, k] = np.bincount(rows, weights=contributions[:, k], minlength=len(texts))
+        jll += self.class_log_prior
+        return jll
+
+    def score(self, texts, features=None):
+        """Classify texts, returning a list of (label, confidence) tuples.
+
+        The confidence is the highest class probability, i.e. the value the
+        sklearn pipeline reports via predict_proba(...).max(). Pass features
+        from features(texts) to time vectorizing and scoring separately.
+        """
+        jll = self.joint_log_likelihood(texts, features)
+        best = jll.argmax(axis=1)
+        top = jll[np.arange(len(best)), best]
+        # max probability = exp(top - logsumexp(jll)), computed stably
+        confidence = 1.0 / np.exp(jll - top[:, None]).sum(axis=1)
+        return [(self.labels[b], float(c)) for b, c in zip(best, confidence)]
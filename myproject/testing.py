@@ -0,0 +1,299 @@
+"""In-memory stand-ins for Supabase, used by the tests.
+
+Only the small part of the postgrest query builder that the app relies on is
+implemented. Every executed query is recorded in ``calls`` so tests can assert
+on the number of database round trips, and setting ``fail_next`` makes that
+many of the following queries raise, to simulate an unavailable database.
+``fail_after_commit`` does the same after applying the query, like a write
+whose response was lost.
+``latency`` adds a fixed delay, in seconds, to every query.
+
+StubAuthServer is a local HTTP server speaking just enough of the Supabase
+Auth (gotrue) API for password logins.
+"""
+import itertools
+import json
+import operator
+import re
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+
+
+_OPERATORS = {
+    'eq': operator.eq,
+    'lt': operator.lt,
+    'lte': operator.le,
+    'gt': operator.gt,
+    'gte': operator.ge,
+}
+
+
+def _compare(op, row, column, value):
+    actual = row.get(column)
+    if actual is None:
+        return False
+    if isinstance(value, str):
+        # Filter values arrive as text, the way PostgREST receives them
+        actual = str(actual).lower() if isinstance(actual, bool) else str(actual)
+    return _OPERATORS[op](actual, value)
+
+
+def _split_conditions(text):
+    """Split a PostgREST logic expression on top-level commas."""
+    parts, depth, quoted, current = [], 0, False, ''
+    for char in text:
+        if char == '"':
+            quoted = not quoted
+        elif not quoted and char == '(':
+            depth += 1
+        elif not quoted and char == ')':
+            depth -= 1
+        if char == ',' and depth == 0 and not quoted:
+            parts.append(current)
+            current = ''
+        else:
+            current += char
+    parts.append(current)
+    return parts
+
+
+def _parse_logic(text):
+    """Parse the filter syntax accepted by ``or_``, e.g. ``a.lt.1,and(b.eq.2,c.gt."x")``."""
+    match = re.fullmatch(r'(and|or)\((.*)\)', text)
+    if match:
+        combine = all if match.group(1) == 'and' else any
+        conditions = [_parse_logic(part) for part in _split_conditions(match.group(2))]
+        return lambda row: combine(c(row) for c in conditions)
+    column, op, value = text.split('.', 2)
+    value = value[1:-1] if value.startswith('"') else value
+    return lambda row: _compare(op, row, column, value)
+
+
+class _Query:
+    def __init__(self, db, table):
+        self._db = db
+        self._table = table
+        self._action = 'select'
+        self._payload = None
+        self._columns = '*'
+        self._filters = []
+        self._negate = False
+        self._order = []
+        self._limit = None
+
+    def select(self, columns='*'):
+        self._action = 'select'
+        self._columns = columns
+        return self
+
+    def insert(self, payload):
+        self._action = 'insert'
+        self._payload = payload
+        return self
+
+    def upsert(self, payload, on_conflict='', ignore_duplicates=False):
+        self._action = 'upsert'
+        self._payload = payload
+        self._on_conflict = on_conflict or 'id'
+        self._ignore_duplicates = ignore_duplicates
+        return self
+
+    def update(self, payload):
+        self._action = 'update'
+        self._payload = payload
+        return self
+
+    @property
+    def not_(self):
+        self._negate = True
+        return self
+
+    def _filter(self, predicate):
+        if self._negate:
+            self._negate = False
+            self._filters.append(lambda row: not predicate(row))
+        else:
+            self._filters.append(predicate)
+        return self
+
+    def eq(self, column, value):
+        return self._filter(lambda row: row.get(column) == value)
+
+    def lt(self, column, value):
+        return self._filter(lambda row: _compare('lt', row, column, value))
+
+    def lte(self, column, value):
+        return self._filter(lambda row: _compare('lte', row, column, value))
+
+    def gt(self, column, value):
+        return self._filter(lambda row: _compare('gt', row, column, value))
+
+    def gte(self, column, value):
+        return self._filter(lambda row: _compare('gte', row, column, value))
+
+    def is_(self, column, value):
+        return self._filter(lambda row: row.get(column) is None)
+
+    def or_(self, filters):
+        return self._filter(_parse_logic(f'or({filters})'))
+
+    def order(self, column, desc=False):
+        self._order.append((column, desc))
+        return self
+
+    def limit(self, count):
+        self._limit = count
+        return self
+
+    def execute(self):
+        return self._db._execute(self)
+
+
+class InMemorySupabase:
+    """Minimal fake of ``supabase.Client`` backed by Python lists."""
+
+    def __init__(self):
+        self.tables = {}
+        self.calls = []
+        self.fail_next = 0
+        self.fail_after_commit = 0
+        self.latency = 0.0
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def table(self, name):
+        return _Query(self, name)
+
+    def _execute(self, query):
+        if self.latency:
+            time.sleep(self.latency)
+        with self._lock:
+            self.calls.append((query._table, query._action))
+            if self.fail_next:
+                self.fail_next -= 1
+                raise ConnectionError('database unavailable')
+            result = self._apply(query)
+            if self.fail_after_commit:
+                self.fail_after_commit -= 1
+                raise TimeoutError('response lost after commit')
+            return result
+
+    def _apply(self, query):
+        rows = self.tables.setdefault(query._table, [])
+
+        if query._action in ('insert', 'upsert'):
+            payload = query._payload
+            records = payload if isinstance(payload, list) else [payload]
+            if query._action == 'insert':
+                ids = {row.get('id') for row in rows}
+                if any(record.get('id') in ids for record in records if 'id' in record):
+                    raise ValueError('duplicate key value violates unique constraint')
+            if query._action == 'upsert':
+                key = query._on_conflict
+                by_key = {row.get(key): row for row in rows}
+            inserted = []
+            for record in records:
+                if query._action == 'upsert':
+                    existing = by_key.get(record.get(key))
+                    if existing is not None:
+                        if not query._ignore_duplicates:
+                            existing.update(record)
+                            inserted.append(dict(existing))
+                        continue
+                row = dict(record)
+                row.setdefault('id', next(self._ids))
+                row.setdefault('created_at', datetime.now(timezone.utc).isoformat())
+                rows.append(row)
+                if query._action == 'upsert':
+                    by_key[row.get(key)] = row
+                inserted.append(dict(row))
+            return SimpleNamespace(data=inserted)
+
+        matched = [row for row in rows if all(f(row) for f in query._filters)]
+
+        if query._action == 'update':
+            for row in matched:
+                row.update(query._payload)
+            return SimpleNamespace(data=[dict(row) for row in matched])
+
+        for column, desc in reversed(query._order):
+            matched.sort(key=lambda row: row.get(column), reverse=desc)
+        if query._limit is not None:
+            matched = matched[:query._limit]
+        if query._columns != '*':
+            columns = [c.strip() for c in query._columns.split(',')]
+            matched = [{c: row.get(c) for c in columns} for row in matched]
+        return SimpleNamespace(data=[dict(row) for row in matched])
+
+
+class _AuthHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        server = self.server.stub
+        body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        with server.lock:
+            server.requests += 1
+            server.connections.add(self.client_address)
+
+        if not self.path.startswith('/auth/v1/token') or server.users.get(body.get('email')) != body.get('password'):
+            self._reply(400, {'code': 400, 'error_code': 'invalid_credentials',
+                              'msg': 'Invalid login credentials'})
+            return
+
+        now = datetime.now(timezone.utc).isoformat()
+        self._reply(200, {
+            'access_token': 'stub-access-token',
+            'refresh_token': 'stub-refresh-token',
+            'token_type': 'bearer',
+            'expires_in': 3600,
+            'user': {
+                'id': str(uuid.uuid4()),
+                'email': body['email'],
+                'aud': 'authenticated',
+                'app_metadata': {},
+                'user_metadata': {},
+                'created_at': now,
+            },
+        })
+
+    def _reply(self, status, payload):
+        data = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class StubAuthServer:
+    """Local gotrue stand-in accepting the password logins in ``users``.
+
+    ``requests`` counts the login requests received and ``connections`` the
+    distinct client sockets they arrived on.
+    """
+
+    def __init__(self, users):
+        self.users = dict(users)
+        self.requests = 0
+        self.connections = set()
+        self.lock = threading.Lock()
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), _AuthHandler)
+        self._server.daemon_threads = True
+        self._server.stub = self
+        self.url = f'http://127.0.0.1:{self._server.server_port}'
+
+    def __enter__(self):
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._server.shutdown()
+        self._server.server_close()
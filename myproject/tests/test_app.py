@@ -1,5 +1,12 @@
+import io
+import json
+
 import pytest
-from myproject.app import app 
+from flask_jwt_extended import create_access_token
+import myproject.app as app_module
+from myproject.app import app
+from myproject.persistence import WriteBehindQueue
+from myproject.testing import InMemorySupabase
 
 @pytest.fixture
 def client():
@@ -7,6 +14,22 @@ def client():
     with app.test_client() as client:
         yield client
 
+@pytest.fixture
+def fake_db(monkeypatch):
+    db = InMemorySupabase()
+    writer = WriteBehindQueue(db, flush_interval=0.01, metrics=app_module.metrics)
+    monkeypatch.setattr(app_module, 'supabase', db)
+    monkeypatch.setattr(app_module, 'writer', writer)
+    monkeypatch.setattr(app_module, 'history_cache', app_module.HistoryCache())
+    yield db
+    writer.close()
+
+@pytest.fixture
+def auth_headers():
+    with app.app_context():
+        token = create_access_token(identity='tester@example.com')
+    return {'Authorization': f'Bearer {token}'}
+
 def test_home_page(client):
     response = client.get('/')
     assert response.status_code == 200
@@ -52,4 +75,277 @@ def test_classify(client):
     })
     assert response.status_code == 200
     assert b"label" in response.data
-    assert b"confidence" in response.data
\ No newline at end of file
+    assert b"confidence" in response.data
+
+def test_classify_batch(client, fake_db, auth_headers):
+    messages = [
+        'WINNER!! You have won a free prize, call now to claim',
+        'Are we still meeting for lunch tomorrow?',
+        'URGENT: your account has been selected for a cash reward',
+    ]
+    response = client.post('/classify/batch', json={'messages': messages}, headers=auth_headers)
+    assert response.status_code == 200
+
+    results = response.json['results']
+    assert len(results) == len(messages)
+    version, expected = app_module.classify_texts(messages)
+    assert response.json['model_version'] == version
+    assert response.headers['X-Model-Version'] == version
+    for result, (label, confidence) in zip(results, expected):
+        assert result['label'] == label
+        assert result['confidence'] == pytest.approx(confidence)
+
+    # The whole batch is persisted in one round trip
+    assert app_module.writer.flush(timeout=5)
+    assert fake_db.calls == [('classified_messages', 'upsert')]
+    rows = fake_db.tables['classified_messages']
+    assert [row['id'] for row in rows] == [result['id'] for result in results]
+    assert all(row['email'] == 'tester@example.com' for row in rows)
+    assert all(row['model_version'] == version for row in rows)
+
+def test_classify_batch_rejects_invalid_input(client, fake_db, auth_headers):
+    response = client.post('/classify/batch', json={'messages': []}, headers=auth_headers)
+    assert response.status_code == 400
+
+    response = client.post('/classify/batch', json={'messages': ['ok', '']}, headers=auth_headers)
+    assert response.status_code == 400
+
+    too_many = ['hello'] * (app_module.MAX_BATCH_SIZE + 1)
+    response = client.post('/classify/batch', json={'messages': too_many}, headers=auth_headers)
+    assert response.status_code == 413
+    assert fake_db.calls == []
+
+def test_repeated_messages_are_served_from_cache(client, fake_db, auth_headers, monkeypatch):
+    monkeypatch.setattr(app_module, 'result_cache', app_module.ClassificationCache(app_module.MemoryBackend()))
+    scored = []
+    _, scorer = app_module.model.get()
+    original = scorer.score
+    monkeypatch.setattr(scorer, 'score', lambda texts, *args: scored.extend(texts) or original(texts, *args))
+
+    messages = ['Claim your FREE prize now', 'claim your free   prize now', 'See you at 6']
+    first = client.post('/classify/batch', json={'messages': messages}, headers=auth_headers).json['results']
+    second = client.post('/classify/batch', json={'messages': messages}, headers=auth_headers).json['results']
+
+    assert [r['label'] for r in first] == [r['label'] for r in second]
+    assert len(scored) == 3
+    stats = client.get('/cache/stats').json
+    assert stats['hits'] == 3
+    assert stats['misses'] == 3
+
+def test_metrics_report_request_and_stage_latency(client, fake_db, auth_headers):
+    client.post('/classify', json={'text': 'Win a free cruise #metrics'}, headers=auth_headers)
+    app_module.writer.flush()
+
+    response = client.get('/metrics')
+    assert response.status_code == 200
+    assert response.content_type.startswith('text/plain')
+    body = response.get_data(as_text=True)
+    assert 'http_request_duration_seconds_count{endpoint="classify",method="POST",status="200"}' in body
+    for stage in ('parse', 'vectorize', 'predict', 'db_insert', 'serialize'):
+        assert f'http_request_stage_duration_seconds_count{{endpoint="classify",stage="{stage}"}}' in body
+    assert 'db_insert_duration_seconds_count{outcome="ok",table="classified_messages"}' in body
+    assert 'spamshield_written' in body
+
+def test_sampled_requests_are_logged_with_their_stages(client, fake_db, auth_headers, monkeypatch, caplog):
+    monkeypatch.setattr(app_module, 'METRICS_LOG_SAMPLE_RATE', 1.0)
+    app_module.request_log.addHandler(caplog.handler)
+    try:
+        client.post('/classify', json={'text': 'Win a free cruise #sampled'}, headers=auth_headers)
+    finally:
+        app_module.request_log.removeHandler(caplog.handler)
+
+    record, = [r for r in caplog.records if r.name == 'spamshield.requests']
+    assert record.levelno >= app_module.request_log.getEffectiveLevel()
+    line = json.loads(record.getMessage())
+    assert line['endpoint'] == 'classify'
+    assert line['status'] == 200
+    assert {'parse', 'predict', 'serialize'} <= line['stages_ms'].keys()
+
+def test_feedback_on_message_not_yet_written(client, fake_db, auth_headers, monkeypatch):
+    slow_writer = WriteBehindQueue(fake_db, flush_interval=60, batch_size=1000)
+    monkeypatch.setattr(app_module, 'writer', slow_writer)
+
+    response = client.post('/classify', json={'text': 'Free entry to win cash'}, headers=auth_headers)
+    message_id = response.json['id']
+    response = client.post('/feedback', json={'id': message_id, 'is_classification_correct': False},
+                           headers=auth_headers)
+    assert response.status_code == 200
+    assert fake_db.calls == []
+
+    slow_writer.close()
+    row, = fake_db.tables['classified_messages']
+    assert row['id'] == message_id
+    assert row['is_classification_correct'] is False
+    assert row['feedback_at']
+
+def test_feedback_on_spilled_message_is_applied_after_replay(client, fake_db, auth_headers,
+                                                             monkeypatch, tmp_path):
+    spill = tmp_path / 'spill.jsonl'
+    writer = WriteBehindQueue(fake_db, flush_interval=0.01, max_retries=0, spill_path=str(spill))
+    monkeypatch.setattr(app_module, 'writer', writer)
+
+    fake_db.fail_next = 1
+    message_id = client.post('/classify', json={'text': 'Free entry to win cash'}, headers=auth_headers).json['id']
+    assert writer.flush(timeout=5)
+    assert spill.exists()
+
+    response = client.post('/feedback', json={'id': message_id, 'is_classification_correct': False},
+                           headers=auth_headers)
+    assert response.status_code == 200
+
+    client.post('/classify', json={'text': 'Lunch tomorrow?'}, headers=auth_headers)
+    writer.close()
+    row = next(row for row in fake_db.tables['classified_messages'] if row['id'] == message_id)
+    assert row['is_classification_correct'] is False
+    assert not spill.exists()
+
+def seed_history(db, count=7):
+    rows = [{
+        'id': f'{i:08d}-0000-0000-0000-000000000000',
+        # Pairs of rows share a timestamp so the id tie-breaker is exercised
+        'created_at': f'2025-01-01T00:00:{i // 2:02d}+00:00',
+        'message': f'message {i}',
+        'label': 'Spam' if i % 2 else 'Ham',
+        'confidence': 0.9,
+        'is_classification_correct': [None, True, False][i % 3],
+        'email': 'tester@example.com',
+    } for i in range(count)]
+    db.tables['classified_messages'] = rows + [dict(rows[0], id='other', email='someone@else.com')]
+    return rows
+
+def test_history_pages_with_cursor(client, fake_db, auth_headers):
+    rows = seed_history(fake_db)
+    seen, cursor = [], None
+    while True:
+        query = {'limit': 2, 'fields': 'label'}
+        if cursor:
+            query['cursor'] = cursor
+        response = client.get('/history', query_string=query, headers=auth_headers)
+        assert response.status_code == 200
+        page = response.json
+        assert len(page) <= 2
+        assert all(set(row) == {'id', 'created_at', 'label'} for row in page)
+        seen.extend(row['id'] for row in page)
+        cursor = response.headers.get('X-Next-Cursor')
+        if not cursor:
+            break
+
+    expected = sorted(rows, key=lambda row: (row['created_at'], row['id']), reverse=True)
+    assert seen == [row['id'] for row in expected]
+
+def test_history_filters(client, fake_db, auth_headers):
+    seed_history(fake_db)
+    spam = client.get('/history?label=Spam', headers=auth_headers).json
+    assert spam and all(row['label'] == 'Spam' for row in spam)
+
+    unreviewed = client.get('/history?feedback=none', headers=auth_headers).json
+    assert unreviewed and all(row['is_classification_correct'] is None for row in unreviewed)
+
+    recent = client.get('/history?since=2025-01-01T00:00:02%2B00:00', headers=auth_headers).json
+    assert {row['id'][:8] for row in recent} == {'00000004', '00000005', '00000006'}
+
+    assert client.get('/history?limit=0', headers=auth_headers).status_code == 400
+    assert client.get('/history?fields=email', headers=auth_headers).status_code == 400
+    assert client.get('/history?cursor=not-a-cursor', headers=auth_headers).status_code == 400
+    assert client.get('/history?since=yesterday', headers=auth_headers).status_code == 400
+    assert client.get('/history?until=2025-13-01', headers=auth_headers).status_code == 400
+    assert fake_db.calls.count(('classified_messages', 'select')) == 3
+
+def test_history_first_page_is_cached_until_user_writes(client, fake_db, auth_headers):
+    seed_history(fake_db)
+    first = client.get('/history', headers=auth_headers).json
+    assert client.get('/history', headers=auth_headers).json == first
+    assert fake_db.calls.count(('classified_messages', 'select')) == 1
+
+    client.post('/classify', json={'text': 'Hello there'}, headers=auth_headers)
+    assert app_module.writer.flush(timeout=5)
+    latest = client.get('/history', headers=auth_headers).json
+    assert len(latest) == len(first) + 1
+    assert fake_db.calls.count(('classified_messages', 'select')) == 2
+
+
+def test_feedback_invalidates_history_after_the_update(client, fake_db, auth_headers, monkeypatch):
+    seed_history(fake_db)
+    row = fake_db.tables['classified_messages'][0]
+    seen = []
+    monkeypatch.setattr(app_module.history_cache, 'invalidate',
+                        lambda user: seen.append(row['is_classification_correct']))
+
+    fake_db.fail_next = 1
+    response = client.post('/feedback', json={'id': row['id'], 'is_classification_correct': False},
+                           headers=auth_headers)
+    assert response.status_code == 500
+    assert seen == []
+
+    response = client.post('/feedback', json={'id': row['id'], 'is_classification_correct': False},
+                           headers=auth_headers)
+    assert response.status_code == 200
+    assert seen == [False]
+
+MBOX = b"""From a@example.com Mon Jan  1 00:00:00 2024
+Subject: WINNER
+Message-ID: <1@example.com>
+
+You have won a free prize, call now to claim
+From b@example.com Mon Jan  1 00:01:00 2024
+Subject: Lunch
+
+Are we still meeting for lunch tomorrow?
+"""
+
+def read_ndjson(response):
+    return [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+
+def test_upload_streams_results_without_text(client, fake_db, auth_headers, monkeypatch):
+    monkeypatch.setattr(app_module, 'UPLOAD_CHUNK_SIZE', 1)
+    response = client.post('/classify/upload?format=mbox', data=MBOX, headers=auth_headers)
+    assert response.status_code == 200
+    assert response.is_streamed
+    assert response.mimetype == 'application/x-ndjson'
+
+    lines = read_ndjson(response)
+    assert [line['ref'] for line in lines[:2]] == ['<1@example.com>', None]
+    assert [line['index'] for line in lines[:2]] == [0, 1]
+    assert all('id' not in line and 'text' not in line for line in lines[:2])
+    assert lines[2]['summary']['messages'] == 2
+    assert lines[2]['summary']['persisted'] is False
+    assert b'free prize' not in response.data
+
+    app_module.writer.flush()
+    assert fake_db.tables.get('classified_messages', []) == []
+
+def test_upload_multipart_csv_persists_in_batches(client, fake_db, auth_headers):
+    rows = ''.join(f'{i},message number {i}\n' for i in range(10))
+    response = client.post('/classify/upload?persist=true', headers=auth_headers, data={
+        'file': (io.BytesIO(('id,text\n' + rows).encode()), 'export.csv'),
+    }, content_type='multipart/form-data')
+    assert response.status_code == 200
+
+    lines = read_ndjson(response)
+    assert [line['ref'] for line in lines[:-1]] == list(range(2, 12))
+    assert lines[-1]['summary'] == {'messages': 10, 'spam': lines[-1]['summary']['spam'], 'skipped': 0,
+                                    'model_version': response.headers['X-Model-Version'], 'persisted': True}
+
+    app_module.writer.flush()
+    stored = fake_db.tables['classified_messages']
+    assert sorted(row['id'] for row in stored) == sorted(line['id'] for line in lines[:-1])
+    assert all(row['email'] == 'tester@example.com' for row in stored)
+    assert fake_db.calls.count(('classified_messages', 'upsert')) == 1
+
+def test_upload_reports_oversize_csv_rows(client, fake_db, auth_headers, monkeypatch):
+    monkeypatch.setattr(app_module, 'UPLOAD_MAX_MESSAGE_BYTES', 1000)
+    data = b'id,text\n1,"' + b'free ' * 1000 + b'"\n2,see you soon\n'
+    response = client.post('/classify/upload?format=csv', data=data, headers=auth_headers)
+
+    lines = read_ndjson(response)
+    assert lines[0] == {'index': 0, 'ref': 2, 'skipped': 'message too large'}
+    assert lines[1]['ref'] == 3 and 'label' in lines[1]
+    assert lines[2]['summary']['messages'] == 1
+    assert lines[2]['summary']['skipped'] == 1
+
+def test_upload_rejects_unknown_format_and_bad_csv(client, fake_db, auth_headers):
+    assert client.post('/classify/upload', data=b'hello', headers=auth_headers).status_code == 400
+    response = client.post('/classify/upload', data=b'id,subject\n1,hi\n', headers=auth_headers,
+                           content_type='text/csv')
+    assert response.status_code == 400
+    assert 'columns' in response.json['error']
@@ -0,0 +1,135 @@
+import threading
+
+import pytest
+from gotrue.errors import AuthApiError
+
+import myproject.app as app_module
+from myproject.app import app
+from myproject.auth import AuthClientPool, LoginRateLimiter, PoolExhausted, gotrue_factory
+from myproject.testing import StubAuthServer
+
+USERS = {'alice@example.com': 'correct-horse'}
+
+
+@pytest.fixture
+def auth_server():
+    with StubAuthServer(USERS) as server:
+        yield server
+
+
+@pytest.fixture
+def client(auth_server, monkeypatch):
+    pool = AuthClientPool(gotrue_factory(auth_server.url, 'anon.key.value'), size=2)
+    monkeypatch.setattr(app_module, 'auth_pool', pool)
+    monkeypatch.setattr(app_module, 'login_limiter', LoginRateLimiter(max_failures=3, window=60))
+    app.config['TESTING'] = True
+    with app.test_client() as client:
+        yield client
+
+
+def test_pool_reuses_clients_and_connections(auth_server):
+    created = []
+    factory = gotrue_factory(auth_server.url, 'anon.key.value')
+    pool = AuthClientPool(lambda: created.append(1) or factory(), size=3)
+    errors = []
+
+    def login():
+        try:
+            for _ in range(5):
+                response = pool.sign_in_with_password({'email': 'alice@example.com', 'password': 'correct-horse'})
+                assert response.session.access_token == 'stub-access-token'
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=login) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    assert auth_server.requests == 40
+    assert len(created) <= 3
+    # Keep-alive: one connection per pooled client, not one per login
+    assert len(auth_server.connections) <= 3
+
+
+def test_pool_raises_auth_errors(auth_server):
+    pool = AuthClientPool(gotrue_factory(auth_server.url, 'anon.key.value'), size=1)
+    with pytest.raises(AuthApiError):
+        pool.sign_in_with_password({'email': 'alice@example.com', 'password': 'wrong'})
+    # The client went back to the pool after the error
+    assert pool.sign_in_with_password({'email': 'alice@example.com', 'password': 'correct-horse'}).session
+
+
+def test_exhausted_pool_answers_503(client, auth_server, monkeypatch):
+    pool = AuthClientPool(gotrue_factory(auth_server.url, 'anon.key.value'), size=1, acquire_timeout=0.05)
+    monkeypatch.setattr(app_module, 'auth_pool', pool)
+    with pool.client():
+        with pytest.raises(PoolExhausted):
+            pool.sign_in_with_password({'email': 'alice@example.com', 'password': 'correct-horse'})
+        response = client.post('/login', json={'email': 'alice@example.com', 'password': 'correct-horse'})
+        assert response.status_code == 503
+        response = client.post('/signup', json={'email': 'bob@example.com', 'password': 'battery-staple'})
+        assert response.status_code == 503
+
+    # The busy client is back, and a failure was not recorded against the user
+    response = client.post('/login', json={'email': 'alice@example.com', 'password': 'correct-horse'})
+    assert response.status_code == 200
+
+
+def test_login_returns_refresh_token_usable_locally(client, auth_server):
+    response = client.post('/login', json={'email': 'alice@example.com', 'password': 'correct-horse'})
+    assert response.status_code == 200
+    refresh_token = response.json['refresh_token']
+
+    response = client.post('/refresh', headers={'Authorization': f'Bearer {refresh_token}'})
+    assert response.status_code == 200
+    response = client.get('/protected', headers={'Authorization': f"Bearer {response.json['access_token']}"})
+    assert b'alice@example.com' in response.data
+    assert auth_server.requests == 1
+
+    # Access tokens can't be used to refresh
+    access_token = client.post('/login', json={'email': 'alice@example.com', 'password': 'correct-horse'}).json['access_token']
+    assert client.post('/refresh', headers={'Authorization': f'Bearer {access_token}'}).status_code == 422
+
+
+def login_from(client, address, password):
+    return client.post('/login', json={'email': 'alice@example.com', 'password': password},
+                       headers={'X-Forwarded-For': address})
+
+
+def test_repeated_bad_credentials_are_rejected_locally(client, auth_server):
+    for _ in range(3):
+        assert login_from(client, '203.0.113.1', 'guess').status_code == 401
+
+    # The same bad credentials from anywhere, and any guess from that client
+    response = login_from(client, '203.0.113.2', 'guess')
+    assert response.status_code == 429
+    assert int(response.headers['Retry-After']) > 0
+    assert login_from(client, '203.0.113.1', 'another guess').status_code == 429
+    assert auth_server.requests == 3
+
+    # Someone else's failures never lock the owner out
+    assert login_from(client, '198.51.100.7', 'correct-horse').status_code == 200
+    assert auth_server.requests == 4
+
+
+def test_only_the_last_forwarded_address_is_trusted(client, auth_server):
+    for i in range(3):
+        response = login_from(client, f'10.0.0.{i}, 203.0.113.1', f'guess {i}')
+        assert response.status_code == 401
+    assert login_from(client, '10.0.0.9, 203.0.113.1', 'guess 9').status_code == 429
+
+
+def test_rate_limiter_window_expires(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr('myproject.auth.time.monotonic', lambda: now[0])
+    limiter = LoginRateLimiter(max_failures=2, window=10)
+    limiter.record_failure('bob')
+    assert limiter.retry_after('bob') == 0
+    limiter.record_failure('bob')
+    assert limiter.retry_after('bob') == pytest.approx(10)
+
+    now[0] += 10.5
+    assert limiter.retry_after('bob') == 0
@@ -0,0 +1,106 @@
+import os
+
+import pytest
+
+from myproject import cache as cache_module
+from myproject.cache import ClassificationCache, FileBackend, MemoryBackend, model_version
+
+
+@pytest.fixture(params=['memory', 'file'])
+def make_backend(request, tmp_path):
+    def make(**kwargs):
+        if request.param == 'memory':
+            return MemoryBackend(**kwargs)
+        return FileBackend(str(tmp_path / 'cache.sqlite3'), **kwargs)
+    return make
+
+
+def test_hit_after_miss_ignores_case_and_whitespace(make_backend):
+    cache = ClassificationCache(make_backend())
+    assert cache.get('Win a FREE prize', 'v1') is None
+    cache.set('Win a FREE prize', 'v1', ('Spam', 0.97))
+
+    assert tuple(cache.get('  win a free\n prize ', 'v1')) == ('Spam', 0.97)
+    assert cache.get('Win a FREE prize', 'v2') is None
+    assert cache.stats()['hits'] == 1
+    assert cache.stats()['misses'] == 2
+
+
+def test_least_recently_used_entry_is_evicted(make_backend, monkeypatch):
+    clock = iter(range(100, 200))
+    monkeypatch.setattr(cache_module.time, 'time', lambda: next(clock))
+    cache = ClassificationCache(make_backend(max_entries=2))
+    cache.set('a', 'v1', ('Ham', 0.9))
+    cache.set('b', 'v1', ('Ham', 0.8))
+    cache.get('a', 'v1')
+    cache.set('c', 'v1', ('Spam', 0.7))
+
+    assert cache.get('b', 'v1') is None
+    assert cache.get('a', 'v1') is not None
+    assert cache.get('c', 'v1') is not None
+    assert cache.stats()['evictions'] == 1
+    assert cache.stats()['size'] == 2
+
+
+def test_entries_expire_after_ttl(make_backend, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(cache_module.time, 'time', lambda: now[0])
+    cache = ClassificationCache(make_backend(ttl=60))
+    cache.set('hello', 'v1', ('Ham', 0.99))
+
+    now[0] += 59
+    assert cache.get('hello', 'v1') is not None
+    now[0] += 2
+    assert cache.get('hello', 'v1') is None
+
+
+def test_file_backend_is_shared_between_instances(tmp_path):
+    path = str(tmp_path / 'shared.sqlite3')
+    worker_a = ClassificationCache(FileBackend(path))
+    worker_b = ClassificationCache(FileBackend(path))
+    worker_a.set('cheap meds online', 'v1', ('Spam', 0.91))
+    assert tuple(worker_b.get('cheap meds online', 'v1')) == ('Spam', 0.91)
+
+
+
+def test_file_backend_keeps_its_size_across_instances(tmp_path):
+    path = str(tmp_path / 'shared.sqlite3')
+    worker_a, worker_b = FileBackend(path, max_entries=3), FileBackend(path, max_entries=3)
+    worker_a.set('a', ('Ham', 0.9))
+    worker_b.set('a', ('Spam', 0.8))
+    worker_b.set('b', ('Ham', 0.7))
+    assert len(worker_a) == len(worker_b) == 2
+
+    assert worker_a.set('c', ('Ham', 0.6)) == 0
+    assert worker_b.set('d', ('Ham', 0.5)) == 1
+    assert len(worker_a) == 3
+    worker_a.clear()
+    assert len(worker_b) == 0
+
+
+def test_file_backend_writes_hits_in_batches(tmp_path):
+    backend = FileBackend(str(tmp_path / 'cache.sqlite3'), touch_batch=3, touch_interval=60)
+    for key in 'abc':
+        backend.set(key, ('Ham', 0.9))
+    statements = []
+    backend._connect().set_trace_callback(statements.append)
+
+    for key in 'abab':
+        assert backend.get(key) == ('Ham', 0.9)
+    assert not any(s.startswith('UPDATE') for s in statements)
+    backend.get('c')
+    assert sum(s.startswith('UPDATE') for s in statements) == 3
+
+
+def test_cache_is_cleared_when_model_file_changes(tmp_path):
+    model = tmp_path / 'spam_classifier.pkl'
+    model.write_bytes(b'old model')
+    version = model_version([str(model)])
+    cache = ClassificationCache(MemoryBackend(), watch=[str(model)], check_interval=0)
+    cache.set('hello', version, ('Ham', 0.99))
+    assert cache.get('hello', version) is not None
+
+    model.write_bytes(b'new model, retrained')
+    os.utime(model, ns=(0, 0))
+    assert cache.get('hello', version) is None
+    assert model_version([str(model)]) != version
@@ -0,0 +1,53 @@
+import math
+
+from myproject.metrics import Histogram, Metrics, RequestTimer
+
+
+def test_histogram_buckets_are_cumulative():
+    histogram = Histogram(buckets=(0.1, 1.0))
+    for value in (0.05, 0.1, 0.5, 2.0):
+        histogram.observe(value)
+
+    cumulative, total, count = histogram.snapshot()
+    assert cumulative == [2, 3, 4]
+    assert math.isclose(total, 2.65)
+    assert count == 4
+    assert histogram.quantile(0.5) == 0.1
+    assert histogram.quantile(0.99) == math.inf
+    assert math.isnan(Histogram().quantile(0.5))
+
+
+def test_render_prometheus_text():
+    metrics = Metrics(buckets=(0.1,))
+    metrics.histogram('latency_seconds', 'Request latency.', endpoint='classify')
+    metrics.observe('latency_seconds', 0.05, endpoint='classify')
+    metrics.observe('latency_seconds', 0.5, endpoint='say "hi"')
+
+    assert metrics.render().splitlines() == [
+        '# HELP latency_seconds Request latency.',
+        '# TYPE latency_seconds histogram',
+        'latency_seconds_bucket{endpoint="classify",le="0.1"} 1',
+        'latency_seconds_bucket{endpoint="classify",le="+Inf"} 1',
+        'latency_seconds_sum{endpoint="classify"} 0.05',
+        'latency_seconds_count{endpoint="classify"} 1',
+        'latency_seconds_bucket{endpoint="say \\"hi\\"",le="0.1"} 0',
+        'latency_seconds_bucket{endpoint="say \\"hi\\"",le="+Inf"} 1',
+        'latency_seconds_sum{endpoint="say \\"hi\\""} 0.5',
+        'latency_seconds_count{endpoint="say \\"hi\\""} 1',
+    ]
+    assert [labels for labels, _ in metrics.collect('latency_seconds')] == [
+        {'endpoint': 'classify'}, {'endpoint': 'say "hi"'}]
+
+
+def test_request_timer_accumulates_repeated_stages():
+    timer = RequestTimer()
+    with timer.stage('cache'):
+        pass
+    with timer.stage('cache'):
+        pass
+    with timer.stage('predict'):
+        pass
+
+    assert set(timer.stages) == {'cache', 'predict'}
+    assert timer.elapsed() >= sum(timer.stages.values())
+
@@ -0,0 +1,92 @@
+import os
+import shutil
+
+import numpy as np
+import pytest
+
+from myproject.model_store import LazyModel, compile_pickles, export_store, load_store
+
+MODEL_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PICKLES = [os.path.join(MODEL_DIR, 'spam_classifier.pkl'), os.path.join(MODEL_DIR, 'vectorizer.pkl')]
+
+TEXTS = [
+    'WINNER!! You have won a free prize, call now to claim',
+    'Are we still meeting for lunch tomorrow?',
+    'URGENT: your account has been selected for a cash reward',
+    'zzzz qqqq unknown tokens only',
+    '',
+    'free ' * 50 + 'lunch',
+]
+
+
+@pytest.fixture(scope='module')
+def compiled():
+    return compile_pickles(*PICKLES)
+
+
+@pytest.fixture
+def store(tmp_path, compiled):
+    version, scorer = compiled
+    directory = str(tmp_path / 'store')
+    export_store(scorer, directory, version)
+    return directory
+
+
+def test_store_round_trip_matches_compiled_pickles(store, compiled):
+    version, scorer = compiled
+    loaded_version, loaded = load_store(store)
+    assert loaded_version == version
+
+    np.testing.assert_allclose(loaded.joint_log_likelihood(TEXTS), scorer.joint_log_likelihood(TEXTS),
+                               rtol=0, atol=1e-12)
+    assert [label for label, _ in loaded.score(TEXTS)] == [label for label, _ in scorer.score(TEXTS)]
+
+
+def test_long_tokens_do_not_widen_the_lookup(store, compiled, monkeypatch):
+    _, loaded = load_store(store)
+    text = 'x' * 20000 + ' free' * 20000
+    widths = []
+    original = np.array
+
+    def recording_array(*args, **kwargs):
+        result = original(*args, **kwargs)
+        widths.append(result.dtype.itemsize)
+        return result
+
+    monkeypatch.setattr(np, 'array', recording_array)
+    assert loaded.score([text]) == compiled[1].score([text])
+    assert max(widths) <= loaded.vocabulary.terms.dtype.itemsize
+
+
+def is_mapped(array):
+    return isinstance(array, np.memmap) or isinstance(array.base, np.memmap)
+
+
+def test_store_arrays_are_memory_mapped(store):
+    _, scorer = load_store(store)
+    assert is_mapped(scorer.log_prob)
+    assert is_mapped(scorer.idf)
+    assert is_mapped(scorer.vocabulary.terms)
+
+
+def test_lazy_model_loads_once_from_fresh_store(tmp_path, store, compiled, monkeypatch):
+    for path in PICKLES:
+        shutil.copy(path, tmp_path)
+    model = LazyModel(store, str(tmp_path / 'spam_classifier.pkl'), str(tmp_path / 'vectorizer.pkl'))
+    monkeypatch.setattr('myproject.model_store.compile_pickles', lambda *paths: pytest.fail('pickles loaded'))
+
+    version, scorer = model.get()
+    assert version == compiled[0]
+    assert is_mapped(scorer.log_prob)
+    assert model.get()[1] is scorer
+
+
+def test_lazy_model_ignores_stale_store(tmp_path, store, compiled):
+    for path in PICKLES:
+        shutil.copy(path, tmp_path)
+    with open(tmp_path / 'vectorizer.pkl', 'ab') as f:
+        f.write(b'\0')
+
+    version, scorer = LazyModel(store, str(tmp_path / 'spam_classifier.pkl'), str(tmp_path / 'vectorizer.pkl')).get()
+    assert version != compiled[0]
+    assert not is_mapped(scorer.log_prob)
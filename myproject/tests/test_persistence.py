@@ -0,0 +1,216 @@
+import json
+import multiprocessing
+import os
+import time
+import uuid
+
+import pytest
+
+from myproject.persistence import QueueFull, WriteBehindQueue
+from myproject.testing import InMemorySupabase
+
+
+@pytest.fixture
+def db():
+    return InMemorySupabase()
+
+
+def rows(db):
+    return db.tables.get('classified_messages', [])
+
+
+def test_records_get_ids_up_front_and_are_written_in_batches(db):
+    writer = WriteBehindQueue(db, batch_size=10, flush_interval=0.01)
+    ids = [writer.submit({'message': f'msg {i}'}) for i in range(25)]
+    assert len(set(ids)) == 25
+    assert all(uuid.UUID(i) for i in ids)
+
+    assert writer.flush(timeout=5)
+    writer.close()
+    assert [row['id'] for row in rows(db)] == ids
+    assert db.calls == [('classified_messages', 'upsert')] * 3
+
+
+def test_records_queued_together_are_written_in_one_upsert(db):
+    writer = WriteBehindQueue(db, batch_size=10, flush_interval=60)
+    writer.submit({'message': 'single'})
+    ids = writer.submit_many([{'message': f'msg {i}'} for i in range(25)])
+    writer.close()
+
+    assert [row['id'] for row in rows(db)][1:] == ids
+    assert db.calls == [('classified_messages', 'upsert')] * 2
+
+
+def test_failed_inserts_are_retried(db):
+    db.fail_next = 2
+    writer = WriteBehindQueue(db, flush_interval=0.01, max_retries=3, backoff=0)
+    writer.submit({'message': 'hello'})
+    writer.close()
+
+    assert len(rows(db)) == 1
+    assert writer.stats() == {'pending': 0, 'written': 1, 'spilled': 0}
+
+
+def test_retrying_a_committed_insert_does_not_duplicate_or_spill(db, tmp_path):
+    spill = tmp_path / 'spill.jsonl'
+    db.fail_after_commit = 1
+    writer = WriteBehindQueue(db, flush_interval=0.01, max_retries=1, backoff=0, spill_path=str(spill))
+    ids = writer.submit_many([{'message': 'a'}, {'message': 'b'}])
+    writer.close()
+
+    assert [row['id'] for row in rows(db)] == ids
+    assert writer.stats() == {'pending': 0, 'written': 2, 'spilled': 0}
+    assert not spill.exists()
+
+
+def test_replayed_records_already_written_are_not_duplicated(db, tmp_path):
+    spill = tmp_path / 'spill.jsonl'
+    record = {'id': str(uuid.uuid4()), 'message': 'committed before the timeout'}
+    db.tables['classified_messages'] = [dict(record)]
+    spill.write_text(json.dumps({'row': record}) + '\n')
+
+    writer = WriteBehindQueue(db, flush_interval=0.01, max_retries=0, spill_path=str(spill))
+    writer.submit({'message': 'next'})
+    writer.close()
+
+    assert len(rows(db)) == 2
+    assert not spill.exists()
+
+
+def test_unwritable_batches_are_spilled_and_replayed(db, tmp_path):
+    spill = tmp_path / 'spill.jsonl'
+    db.fail_next = 2
+    writer = WriteBehindQueue(db, flush_interval=0.01, max_retries=1, backoff=0, spill_path=str(spill))
+    first = writer.submit({'message': 'first'})
+    assert writer.flush(timeout=5)
+    assert rows(db) == []
+    assert [json.loads(line)['row']['id'] for line in spill.read_text().splitlines()] == [first]
+
+    # The next successful write also replays the spill file
+    second = writer.submit({'message': 'second'})
+    writer.close()
+    assert sorted(row['id'] for row in rows(db)) == sorted([first, second])
+    assert not spill.exists()
+
+
+def test_full_queue_spills_or_raises(db, tmp_path):
+    writer = WriteBehindQueue(db, flush_interval=60, batch_size=100, max_queue=2)
+    writer.submit_many([{'message': 'a'}, {'message': 'b'}])
+    with pytest.raises(QueueFull):
+        writer.submit({'message': 'c'})
+    writer.close()
+
+    db = InMemorySupabase()
+    spill = tmp_path / 'spill.jsonl'
+    writer = WriteBehindQueue(db, flush_interval=60, batch_size=100, max_queue=0, spill_path=str(spill))
+    message_id = writer.submit({'message': 'd'})
+    assert writer.stats()['spilled'] == 1
+    writer.close()
+
+    # The background thread may already have replayed the spill file
+    spilled = [json.loads(line)['row']['id'] for line in spill.read_text().splitlines()] if spill.exists() else []
+    assert [row['id'] for row in rows(db)] + spilled == [message_id]
+
+
+def test_close_drains_queue(db):
+    writer = WriteBehindQueue(db, flush_interval=60, batch_size=1000)
+    writer.submit_many([{'message': str(i)} for i in range(50)])
+    assert rows(db) == []
+    writer.close()
+    assert len(rows(db)) == 50
+
+
+def test_close_spills_records_left_when_the_database_is_down(db, tmp_path):
+    spill = tmp_path / 'spill.jsonl'
+    db.fail_next = 1000
+    writer = WriteBehindQueue(db, flush_interval=0.01, batch_size=10, max_retries=100, backoff=0.05,
+                              spill_path=str(spill))
+    ids = writer.submit_many([{'message': str(i)} for i in range(25)])
+    writer.close(timeout=0.2)
+
+    spilled = [json.loads(line)['row']['id'] for line in spill.read_text().splitlines()]
+    assert sorted(spilled) == sorted(ids)
+
+
+def test_feedback_survives_a_spilled_write_that_had_committed(db, tmp_path):
+    spill = tmp_path / 'spill.jsonl'
+    db.fail_after_commit = 1
+    db.latency = 0.2
+    writer = WriteBehindQueue(db, flush_interval=0.01, max_retries=0, spill_path=str(spill))
+    message_id = writer.submit({'message': 'hello'})
+    time.sleep(0.1)
+    # The write is in flight; it commits, but its response is lost
+    assert writer.update_pending(message_id, {'is_classification_correct': False})
+    assert writer.flush(timeout=5)
+    assert writer.stats()['spilled'] == 1
+
+    db.latency = 0
+    writer.submit({'message': 'next'})
+    writer.close()
+    row = next(row for row in rows(db) if row['id'] == message_id)
+    assert row['is_classification_correct'] is False
+    assert not spill.exists()
+
+
+def test_updates_to_spilled_records_are_applied_after_replay(db, tmp_path):
+    spill = tmp_path / 'spill.jsonl'
+    db.fail_next = 1
+    writer = WriteBehindQueue(db, flush_interval=0.01, max_retries=0, spill_path=str(spill))
+    message_id = writer.submit({'message': 'hello'})
+    assert writer.flush(timeout=5)
+
+    assert writer.update(message_id, {'is_classification_correct': True})
+    assert not writer.update('unknown', {'is_classification_correct': True})
+    writer.submit({'message': 'next'})
+    writer.close()
+
+    row = next(row for row in rows(db) if row['id'] == message_id)
+    assert row['is_classification_correct'] is True
+    assert not spill.exists()
+
+
+def test_replay_files_left_by_dead_workers_are_replayed(db, tmp_path):
+    spill = str(tmp_path / 'spill.jsonl')
+    child = multiprocessing.get_context('fork').Process(target=lambda: None)
+    child.start()
+    child.join()
+    orphan = f'{spill}.{child.pid}.replay'
+    spill_records(orphan, 120)
+    running = f'{spill}.{os.getppid()}.replay'
+    spill_records(running, 1)
+
+    writer = WriteBehindQueue(db, batch_size=50, spill_path=spill)
+    writer._replay_spill()
+
+    assert len(rows(db)) == 120
+    assert not os.path.exists(orphan)
+    assert os.path.exists(running)
+
+
+def spill_records(path, count):
+    writer = WriteBehindQueue(InMemorySupabase(), spill_path=path)
+    for i in range(count):
+        writer._spill([{'id': f'{i:05d}', 'message': 'spilled'}])
+
+
+def test_replay_does_not_lose_records_spilled_by_other_workers(db, tmp_path):
+    spill = str(tmp_path / 'spill.jsonl')
+    writer = WriteBehindQueue(db, batch_size=50, spill_path=spill)
+    child = multiprocessing.get_context('fork').Process(target=spill_records, args=(spill, 2000))
+    child.start()
+    while child.is_alive():
+        writer._replay_spill()
+    child.join()
+    writer._replay_spill()
+
+    assert sorted(row['id'] for row in rows(db)) == [f'{i:05d}' for i in range(2000)]
+
+
+def test_update_pending_only_applies_to_unwritten_records(db):
+    writer = WriteBehindQueue(db, flush_interval=60, batch_size=1000)
+    message_id = writer.submit({'message': 'hello'})
+    assert writer.update_pending(message_id, {'is_classification_correct': True})
+    writer.close()
+
+    assert rows(db)[0]['is_classification_correct'] is True
+    assert not writer.update_pending(message_id, {'is_classification_correct': False})
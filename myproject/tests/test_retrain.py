@@ -0,0 +1,157 @@
+import os
+import threading
+import time
+
+import joblib
+import numpy as np
+import pytest
+
+from myproject.model_store import LazyModel, current_version, load_store, publish, read_meta
+from myproject.retrain import classifier_version, feedback_rows, is_holdout, retrain, true_label
+from myproject.scorer import CompiledScorer, fitted_idf
+from myproject.testing import InMemorySupabase
+
+MODEL_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CLASSIFIER = os.path.join(MODEL_DIR, 'spam_classifier.pkl')
+VECTORIZER = os.path.join(MODEL_DIR, 'vectorizer.pkl')
+
+
+@pytest.fixture(scope='module')
+def pipeline():
+    vectorizer = joblib.load(VECTORIZER)
+    vectorizer.idf_ = fitted_idf(vectorizer)
+    return vectorizer, joblib.load(CLASSIFIER)
+
+
+@pytest.fixture
+def db():
+    db = InMemorySupabase()
+    spam = ['Win a free iPhone, text WIN now', 'Cheap loans approved instantly, reply YES']
+    ham = ['Running late, see you at 7', 'Can you send me the notes from class?']
+    rows = []
+    for i in range(60):
+        text = (spam if i % 2 else ham)[i % 4 // 2]
+        rows.append({
+            'id': f'{i:04d}',
+            'created_at': f'2025-03-01T00:{i // 60:02d}:{i % 60:02d}+00:00',
+            'feedback_at': f'2025-03-01T01:{i // 60:02d}:{i % 60:02d}+00:00',
+            'message': text,
+            # Every third row was classified wrongly and corrected by the user
+            'label': ('Spam' if i % 2 else 'Ham') if i % 3 else ('Ham' if i % 2 else 'Spam'),
+            'is_classification_correct': bool(i % 3),
+        })
+    rows.append({'id': '9999', 'created_at': '2025-03-02T00:00:00+00:00', 'message': 'no feedback',
+                 'label': 'Ham', 'is_classification_correct': None, 'feedback_at': None})
+    db.tables['classified_messages'] = rows
+    return db
+
+
+def test_true_label_flips_incorrect_classifications():
+    assert true_label({'label': 'Spam', 'is_classification_correct': True}) == 1
+    assert true_label({'label': 'Spam', 'is_classification_correct': False}) == 0
+    assert true_label({'label': 'Ham', 'is_classification_correct': False}) == 1
+
+
+def test_feedback_rows_stream_in_chunks_after_watermark(db):
+    chunks = list(feedback_rows(db, chunk_size=25))
+    assert [len(chunk) for chunk in chunks] == [25, 25, 10]
+    assert [row['id'] for chunk in chunks for row in chunk] == [f'{i:04d}' for i in range(60)]
+
+    later = list(feedback_rows(db, since=('2025-03-01T01:00:49+00:00', '0049'), chunk_size=25))
+    assert [row['id'] for chunk in later for row in chunk] == [f'{i:04d}' for i in range(50, 60)]
+
+    settled = list(feedback_rows(db, until='2025-03-01T01:00:10+00:00'))
+    assert [row['id'] for chunk in settled for row in chunk] == [f'{i:04d}' for i in range(10)]
+
+
+def test_late_feedback_on_old_messages_is_streamed(db):
+    rows = db.tables['classified_messages']
+    rows[-1].update(is_classification_correct=False, feedback_at='2025-03-01T02:00:00+00:00')
+    rows[0].update(is_classification_correct=False, feedback_at='2025-03-01T02:00:01+00:00')
+
+    later = list(feedback_rows(db, since=('2025-03-01T01:00:59+00:00', '0059')))
+    assert [row['id'] for chunk in later for row in chunk] == ['9999', '0000']
+
+
+def test_retrain_updates_a_copy_incrementally(db, pipeline):
+    vectorizer, classifier = pipeline
+    before = classifier.class_count_.copy()
+    updated, report = retrain(db, classifier, vectorizer, chunk_size=25, holdout_fraction=0.2)
+
+    holdout = sum(is_holdout(f'{i:04d}', 0.2) for i in range(60))
+    assert report['holdout'] == holdout
+    assert report['trained'] == 60 - holdout
+    assert report['watermark'] == ['2025-03-01T01:00:59+00:00', '0059']
+    assert updated.class_count_.sum() == before.sum() + report['trained']
+    assert (classifier.class_count_ == before).all()
+    assert report['new_accuracy'] >= report['old_accuracy']
+
+
+def test_changed_feedback_replaces_what_was_learned(db, pipeline):
+    vectorizer, classifier = pipeline
+    trained_labels = {}
+    first, report = retrain(db, classifier, vectorizer, holdout_fraction=0.2,
+                            trained_labels=trained_labels)
+    flipped, same = [f'{i:04d}' for i in range(60) if not is_holdout(f'{i:04d}', 0.2)][:2]
+    assert trained_labels[flipped] == true_label(db.tables['classified_messages'][int(flipped)])
+
+    # One user changes their answer, another repeats theirs
+    for row_id, feedback_at in ((flipped, '2025-03-01T02:00:00+00:00'), (same, '2025-03-01T02:00:01+00:00')):
+        row = db.tables['classified_messages'][int(row_id)]
+        row['feedback_at'] = feedback_at
+        if row_id == flipped:
+            row['is_classification_correct'] = not row['is_classification_correct']
+    second, report = retrain(db, first, vectorizer, since=report['watermark'], holdout_fraction=0.2,
+                             trained_labels=trained_labels)
+
+    assert (report['trained'], report['corrected']) == (1, 1)
+    assert trained_labels[flipped] == true_label(db.tables['classified_messages'][int(flipped)])
+    # Same counts as learning only the final answers
+    expected, _ = retrain(db, classifier, vectorizer, holdout_fraction=0.2)
+    assert np.allclose(second.class_count_, expected.class_count_)
+    assert np.allclose(second.feature_count_, expected.feature_count_)
+    assert np.allclose(second.feature_log_prob_, expected.feature_log_prob_)
+
+
+def test_published_model_is_hot_swapped(tmp_path, db, pipeline):
+    vectorizer, classifier = pipeline
+    registry = str(tmp_path / 'models')
+    model = LazyModel(str(tmp_path / 'no-store'), CLASSIFIER, VECTORIZER,
+                      registry_dir=registry, check_interval=0)
+    old_version, _ = model.get()
+
+    errors = []
+    stop = threading.Event()
+
+    def serve():
+        while not stop.is_set():
+            try:
+                model.get()[1].score(['Win a free iPhone'])
+            except Exception as e:
+                errors.append(e)
+
+    threads = [threading.Thread(target=serve) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+
+    updated, report = retrain(db, classifier, vectorizer)
+    version = classifier_version(updated, VECTORIZER)
+    publish(registry, version, CompiledScorer.from_sklearn(vectorizer, updated),
+            classifier=updated, trained_labels={'0001': 1}, trained_through=report['watermark'])
+    # Requests that find the swap in progress keep the old model meanwhile
+    deadline = time.monotonic() + 5
+    while model.get()[0] != version and time.monotonic() < deadline:
+        time.sleep(0.01)
+    new_version, scorer = model.get()
+
+    stop.set()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    assert new_version == version != old_version
+    assert current_version(registry) == version
+    assert read_meta(os.path.join(registry, version))['trained_through'] == report['watermark']
+    assert os.path.exists(os.path.join(registry, version, 'spam_classifier.pkl'))
+    assert joblib.load(os.path.join(registry, version, 'trained_labels.pkl')) == {'0001': 1}
+    assert load_store(os.path.join(registry, version))[1].score(['hi']) == scorer.score(['hi'])
@@ -0,0 +1,117 @@
+import os
+import random
+
+import joblib
+import numpy as np
+import pytest
+from sklearn.naive_bayes import MultinomialNB
+from sklearn.feature_extraction.text import TfidfVectorizer
+
+from myproject.scorer import CompiledScorer, fitted_idf
+
+MODEL_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SAMPLES = [
+    'This is a test message',
+    'WINNER!! You have won a free prize, call 08001234567 now to claim',
+    'Are we still meeting for lunch tomorrow?',
+    'URGENT: your account has been selected for a cash reward. Reply YES',
+    'ok',
+    '!!! ??? ...',
+    '',
+    'Ünïcödé wörds and emojis 🎉🎉 mixed with FREE free FrEe',
+    'free ' * 200,
+    'Hey,\nsorry I missed your call.\tCan you text me later?',
+]
+
+
+@pytest.fixture(scope='module')
+def pipeline():
+    vectorizer = joblib.load(os.path.join(MODEL_DIR, 'vectorizer.pkl'))
+    classifier = joblib.load(os.path.join(MODEL_DIR, 'spam_classifier.pkl'))
+    # Newer scikit-learn ignores the idf stored by older pickles; restore it so
+    # the reference pipeline scores with the weights the model was trained on
+    vectorizer.idf_ = fitted_idf(vectorizer)
+    return vectorizer, classifier
+
+
+@pytest.fixture(scope='module')
+def corpus(pipeline):
+    vectorizer, _ = pipeline
+    rng = random.Random(1234)
+    vocabulary = sorted(vectorizer.vocabulary_)
+    noise = ['zzqx', 'qwertyuiop', '42', 'a', 'I', 'lol!!', 'http://spam.example/win']
+    texts = list(SAMPLES)
+    for _ in range(300):
+        words = rng.choices(vocabulary + noise, k=rng.randint(1, 60))
+        words = [w.upper() if rng.random() < 0.2 else w for w in words]
+        texts.append(' '.join(words))
+    return texts
+
+
+def expected(vectorizer, classifier, texts):
+    features = vectorizer.transform(texts)
+    probabilities = classifier.predict_proba(features)
+    labels = ['Spam' if p == 1 else 'Ham' for p in classifier.predict(features)]
+    return labels, probabilities.max(axis=1)
+
+
+def test_joint_log_likelihood_matches_sklearn(pipeline, corpus):
+    vectorizer, classifier = pipeline
+    scorer = CompiledScorer.from_sklearn(vectorizer, classifier)
+    reference = classifier.predict_joint_log_proba(vectorizer.transform(corpus))
+    np.testing.assert_allclose(scorer.joint_log_likelihood(corpus), reference, rtol=0, atol=1e-9)
+
+
+def test_features_match_the_vectorizer(pipeline, corpus):
+    vectorizer, classifier = pipeline
+    scorer = CompiledScorer.from_sklearn(vectorizer, classifier)
+    rows, columns, weights = scorer.features(corpus)
+
+    matrix = vectorizer.transform(corpus).tocoo()
+    assert sorted(zip(rows, columns)) == sorted(zip(matrix.row, matrix.col))
+    dense = np.zeros(matrix.shape)
+    dense[rows, columns] = weights
+    np.testing.assert_allclose(dense, matrix.toarray(), rtol=0, atol=1e-12)
+    assert scorer.score(corpus, (rows, columns, weights)) == scorer.score(corpus)
+
+
+def test_labels_and_confidence_match_sklearn(pipeline, corpus):
+    vectorizer, classifier = pipeline
+    scorer = CompiledScorer.from_sklearn(vectorizer, classifier)
+    labels, confidences = expected(vectorizer, classifier, corpus)
+
+    results = scorer.score(corpus)
+    assert [label for label, _ in results] == labels
+    np.testing.assert_allclose([c for _, c in results], confidences, rtol=0, atol=1e-9)
+
+
+def test_single_and_batch_scoring_agree(pipeline, corpus):
+    scorer = CompiledScorer.from_sklearn(*pipeline)
+    batch = scorer.score(corpus[:50])
+    for text, result in zip(corpus[:50], batch):
+        (label, confidence), = scorer.score([text])
+        assert label == result[0]
+        assert confidence == pytest.approx(result[1], abs=1e-12)
+
+
+def test_parity_on_freshly_trained_model():
+    texts = ['free prize now', 'call me later', 'win cash now now', 'lunch at noon?',
+             'claim your free reward', 'see you at the meeting']
+    vectorizer = TfidfVectorizer()
+    classifier = MultinomialNB().fit(vectorizer.fit_transform(texts), [1, 0, 1, 0, 1, 0])
+    scorer = CompiledScorer.from_sklearn(vectorizer, classifier)
+
+    probe = texts + ['free lunch', 'unknown words only', 'NOW NOW NOW']
+    labels, confidences = expected(vectorizer, classifier, probe)
+    results = scorer.score(probe)
+    assert [label for label, _ in results] == labels
+    np.testing.assert_allclose([c for _, c in results], confidences, rtol=0, atol=1e-9)
+
+
+def test_unsupported_vectorizer_settings_are_rejected():
+    vectorizer = TfidfVectorizer(ngram_range=(1, 2))
+    features = vectorizer.fit_transform(['free prize', 'see you soon'])
+    classifier = MultinomialNB().fit(features, [1, 0])
+    with pytest.raises(ValueError):
+        CompiledScorer.from_sklearn(vectorizer, classifier)
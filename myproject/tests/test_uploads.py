@@ -0,0 +1,116 @@
+import io
+
+import pytest
+
+from myproject.uploads import chunked, detect_format, iter_csv, iter_eml, iter_mbox
+
+MBOX = b"""From alice@example.com Mon Jan  1 00:00:00 2024
+Subject: =?utf-8?q?You_won_=E2=82=AC1000?=
+Message-ID: <1@example.com>
+
+Claim your FREE prize now
+>From the prize team
+From bob@example.com Mon Jan  1 00:01:00 2024
+Subject: Lunch
+Content-Type: multipart/alternative; boundary="b"
+
+--b
+Content-Type: text/html
+
+<p>See you at noon &amp; bring the notes</p>
+--b--
+From carol@example.com Mon Jan  1 00:02:00 2024
+Subject: Report
+Content-Type: multipart/mixed; boundary="m"
+
+--m
+Content-Type: text/plain
+
+Report attached.
+--m
+Content-Type: text/plain
+Content-Disposition: attachment; filename="report.txt"
+
+not part of the message
+--m--
+"""
+
+
+class ReadCounter(io.BytesIO):
+    """BytesIO that records the largest single read."""
+
+    largest = 0
+
+    def read(self, size=-1):
+        data = super().read(size)
+        self.largest = max(self.largest, len(data))
+        return data
+
+    def readline(self, size=-1):
+        data = super().readline(size)
+        self.largest = max(self.largest, len(data))
+        return data
+
+
+def test_mbox_messages_are_split_and_decoded():
+    assert list(iter_mbox(io.BytesIO(MBOX))) == [
+        ('<1@example.com>', 'You won €1000\nClaim your FREE prize now\nFrom the prize team'),
+        (None, 'Lunch\n See you at noon & bring the notes'),
+        (None, 'Report\nReport attached.'),
+    ]
+
+
+def test_mbox_is_read_incrementally_and_long_messages_are_truncated():
+    body = b'free ' * 100000
+    mbox = b'From a@example.com Mon Jan  1 00:00:00 2024\nSubject: big\n\n' + body + b'\n'
+    stream = ReadCounter(mbox * 3)
+
+    messages = iter_mbox(stream, max_bytes=1000)
+    ref, text = next(messages)
+    assert len(text) < 1000
+    assert stream.tell() < len(mbox) * 2
+    assert len(list(messages)) == 2
+    assert stream.largest <= 1 << 16
+
+
+def test_eml_is_a_single_message():
+    eml = MBOX.split(b'\n', 1)[1].split(b'\nFrom bob')[0]
+    assert list(iter_eml(io.BytesIO(eml))) == [
+        ('<1@example.com>', 'You won €1000\nClaim your FREE prize now\n>From the prize team'),
+    ]
+
+
+def test_csv_rows_by_column():
+    data = b'\xef\xbb\xbfid,Message\n1,"Win a free\nprize"\n2,see you soon\n3\n'
+    assert list(iter_csv(io.BytesIO(data))) == [(3, 'Win a free\nprize'), (4, 'see you soon')]
+    assert list(iter_csv(io.BytesIO(data), column='id')) == [(3, '1'), (4, '2'), (5, '3')]
+
+
+def test_long_unquoted_csv_row_is_read_whole():
+    data = b'id,text\n1,' + b'a ' * 40000 + b'x,y,z\n2,ok\n'
+    rows = list(iter_csv(io.BytesIO(data)))
+    assert [(ref, len(text)) for ref, text in rows] == [(2, 80001), (3, 2)]
+
+
+def test_csv_fields_up_to_max_bytes_are_read_and_larger_rows_skipped():
+    data = (b'id,text\n1,"' + b'a' * 200000 + b'"\n2,"quoted ""x""\nline"\n'
+            + b'3,"' + b'line\n' * 100 + b'"\n4,fine\n')
+    assert [(ref, len(text)) for ref, text in iter_csv(io.BytesIO(data))] == [
+        (2, 200000), (4, 15), (105, 500), (106, 4)]
+    assert list(iter_csv(io.BytesIO(data), max_bytes=100)) == [
+        (2, None), (4, 'quoted "x"\nline'), (105, None), (106, 'fine')]
+
+
+def test_csv_without_text_column_is_rejected_before_reading_rows():
+    with pytest.raises(ValueError):
+        iter_csv(io.BytesIO(b'id,subject\n1,hello\n'))
+    with pytest.raises(ValueError):
+        iter_csv(io.BytesIO(b'text\nhello\n'), column='body')
+
+
+def test_detect_format_and_chunked():
+    assert detect_format('Export.MBOX') == 'mbox'
+    assert detect_format('mail.eml', 'text/csv') == 'eml'
+    assert detect_format(None, 'text/csv') == 'csv'
+    assert detect_format('notes.txt', 'text/plain') is None
+    assert list(chunked(iter(range(5)), 2)) == [[0, 1], [2, 3], [4]]
@@ -0,0 +1,212 @@
+"""Incremental parsers for uploaded mailboxes and message files.
+
+Each parser reads a binary file object a line or block at a time and yields
+(ref, text) pairs, one per message, so an upload is never held in memory
+as a whole. ref identifies the message to the client: the Message-ID of an
+email, or the line number of a CSV row. text is the subject and the readable
+body, which is what the model was trained on.
+
+Emails larger than max_bytes are truncated; the rest of them is skipped.
+CSV rows larger than max_bytes are skipped and yielded with text None, as
+cutting a row short would lose its columns.
+"""
+import codecs
+import csv
+import html
+import io
+import itertools
+import os
+import re
+from email import policy
+from email.parser import BytesFeedParser
+
+FORMATS = ('mbox', 'eml', 'csv')
+
+EXTENSIONS = {'.mbox': 'mbox', '.mbx': 'mbox', '.eml': 'eml', '.csv': 'csv'}
+CONTENT_TYPES = {
+    'application/mbox': 'mbox',
+    'message/rfc822': 'eml',
+    'text/csv': 'csv',
+}
+
+# Columns looked for, in order, when a CSV upload does not name one
+TEXT_COLUMNS = ('text', 'message', 'body', 'content', 'email')
+
+MAX_MESSAGE_BYTES = 1 << 20
+READ_SIZE = 1 << 16
+
+_TAG = re.compile(r'<[^>]*>')
+_SPACE = re.compile(r'\s+')
+
+
+def detect_format(filename=None, content_type=None):
+    """Guess the upload format from its file name or content type."""
+    if filename:
+        fmt = EXTENSIONS.get(os.path.splitext(filename)[1].lower())
+        if fmt:
+            return fmt
+    return CONTENT_TYPES.get((content_type or '').lower())
+
+
+def message_text(message):
+    """Return the subject and the text parts of an email as one string.
+
+    text/plain parts are preferred; HTML is only used, without its tags,
+    when a message has no plain text. Attachments are ignored.
+    """
+    plain, markup = [], []
+    for part in message.walk():
+        if part.is_multipart() or part.get_filename():
+            continue
+        content_type = part.get_content_type()
+        if content_type not in ('text/plain', 'text/html'):
+            continue
+        payload = part.get_payload(decode=True) or b''
+        try:
+            text = payload.decode(part.get_content_charset() or 'utf-8', errors='replace')
+        except LookupError:
+            text = payload.decode('utf-8', errors='replace')
+        if content_type == 'text/plain':
+            plain.append(text)
+        else:
+            markup.append(_SPACE.sub(' ', html.unescape(_TAG.sub(' ', text))))
+
+    try:
+        subject = str(message.get('Subject') or '')
+    except Exception:
+        subject = ''
+    return '\n'.join([subject] + (plain or markup)).strip()
+
+
+def message_ref(message):
+    try:
+        return str(message.get('Message-ID') or '').strip() or None
+    except Exception:
+        return None
+
+
+class _MessageBuffer:
+    """Feeds one message to the email parser, up to max_bytes of it."""
+
+    def __init__(self, max_bytes):
+        self.parser = BytesFeedParser(policy=policy.default)
+        self.remaining = max_bytes
+
+    def feed(self, data):
+        if self.remaining > 0:
+            self.parser.feed(data[:self.remaining])
+            self.remaining -= len(data)
+
+    def close(self):
+        message = self.parser.close()
+        return message_ref(message), message_text(message)
+
+
+def _lines(stream):
+    """Yield the lines of a binary stream, split every READ_SIZE bytes."""
+    if isinstance(stream, io.RawIOBase):
+        # Raw streams, like the WSGI input, read lines a byte at a time
+        stream = io.BufferedReader(stream, READ_SIZE)
+    return iter(lambda: stream.readline(READ_SIZE), b'')
+
+
+def iter_eml(stream, max_bytes=MAX_MESSAGE_BYTES):
+    """Yield the single message of an .eml file."""
+    buffer = _MessageBuffer(max_bytes)
+    for block in iter(lambda: stream.read(READ_SIZE), b''):
+        buffer.feed(block)
+    yield buffer.close()
+
+
+def iter_mbox(stream, max_bytes=MAX_MESSAGE_BYTES):
+    """Yield the messages of an mbox file, split on its "From " lines."""
+    buffer = None
+    at_line_start = True
+    for line in _lines(stream):
+        # readline stops at READ_SIZE, so only a real line start can be a separator
+        if at_line_start and line.startswith(b'From '):
+            if buffer is not None:
+                yield buffer.close()
+            buffer = _MessageBuffer(max_bytes)
+        elif buffer is not None:
+            if at_line_start and line.startswith(b'>From '):
+                line = line[1:]
+            buffer.feed(line)
+        at_line_start = line.endswith(b'\n')
+    if buffer is not None:
+        yield buffer.close()
+
+
+class _CsvLines:
+    """Whole decoded lines for csv.reader, with oversize records blanked out.
+
+    Once the record being read passes max_bytes, the rest of its lines are
+    reduced to their quote parity, which is all the reader needs to find
+    where the record ends, and the record is flagged as oversize.
+    """
+
+    def __init__(self, stream, max_bytes):
+        self.pieces = _lines(stream)
+        self.max_bytes = max_bytes
+        self.decoder = codecs.getincrementaldecoder('utf-8-sig')(errors='replace')
+        self.oversize = False
+        self.record_bytes = 0
+
+    def end_record(self):
+        """Called once the reader has returned a record; returns its flag."""
+        oversize = self.oversize
+        self.oversize = False
+        self.record_bytes = 0
+        return oversize
+
+    def __iter__(self):
+        line = []
+        for piece in self.pieces:
+            self.record_bytes += len(piece)
+            if self.record_bytes > self.max_bytes:
+                self.oversize = True
+                piece = b'"' * (piece.count(b'"') % 2) + (b'\n' if piece.endswith(b'\n') else b'')
+            line.append(piece)
+            if piece.endswith(b'\n'):
+                yield self.decoder.decode(b''.join(line))
+                line = []
+        if line:
+            yield self.decoder.decode(b''.join(line), final=True)
+
+
+def iter_csv(stream, column=None, max_bytes=MAX_MESSAGE_BYTES):
+    """Return an iterator over the text column of a CSV file with a header.
+
+    The header is read straight away and ValueError raised if it has no
+    text column, so callers can reject the upload before streaming results.
+    """
+    # The limit is process-wide; fields up to max_bytes must not raise
+    if csv.field_size_limit() < max_bytes:
+        csv.field_size_limit(max_bytes)
+    lines = _CsvLines(stream, max_bytes)
+    reader = csv.reader(lines)
+    header = [name.strip().lower() for name in next(reader, [])]
+    lines.end_record()
+    wanted = [column.strip().lower()] if column else TEXT_COLUMNS
+    index = next((header.index(name) for name in wanted if name in header), None)
+    if index is None:
+        raise ValueError(f"CSV upload needs one of the columns: {', '.join(wanted)}")
+    return _csv_rows(reader, lines, index)
+
+
+def _csv_rows(reader, lines, index):
+    for row in reader:
+        if lines.end_record():
+            yield reader.line_num, None
+        elif len(row) > index:
+            yield reader.line_num, row[index]
+
+
+def chunked(iterable, size):
+    """Yield lists of up to size items from iterable."""
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk